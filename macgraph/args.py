@@ -3,6 +3,7 @@ import argparse
 import os.path
 import yaml
 import pathlib
+import tempfile
 import tensorflow as tf
 
 def absu(x):
@@ -16,6 +17,12 @@ ACTIVATION_FNS = {
 	"id": tf.identity
 }
 
+# See util.runtime_check
+ASSERTION_LEVELS = ["debug", "sampled", "off"]
+
+# See model_fn, from least to most data copied out per example
+PREDICT_OUTPUTS = ["labels", "scores", "full"]
+
 global_args = {}
 
 
@@ -27,12 +34,17 @@ def generate_args_derivatives(args):
 	# Expand input dirs
 	for i in [*r["modes"], "all"]:
 		r[i+"_input_path"] = os.path.join(args["input_dir"], i+"_input.tfrecords")
+		r[i+"_input_pattern"] = os.path.join(args["input_dir"], i+"_input*.tfrecords*")
+		r[i+"_columns_pattern"] = os.path.join(args["input_dir"], i+"_input*.columns")
 
 	r["vocab_path"] = os.path.join(args["input_dir"], "vocab.txt")
+	r["type_ids_path"] = os.path.join(args["input_dir"], "type_ids.txt")
 	r["config_path"] = os.path.join(args["model_dir"], "config.yaml")
 	r["question_types_path"] = os.path.join(args["input_dir"], "types.yaml")
 	r["answer_classes_path"] = os.path.join(args["input_dir"], "answer_classes.yaml")
 	r["answer_classes_types_path"] = os.path.join(args["input_dir"], "answer_classes_types.yaml")
+	r["manifest_path"] = os.path.join(args["input_dir"], "manifest.yaml")
+	r["doc_hashes_path"] = os.path.join(args["input_dir"], "doc_hashes.txt")
 
 	if args["control_width"] is None:
 		r["control_width"] = args["embed_width"] * args["control_heads"]
@@ -56,8 +68,9 @@ def get_args(extend=lambda parser:None, argv=None):
 	parser.add_argument('--model-dir',      			type=str, default="./output/default")
 
 	# Used in train / predict / build
-	parser.add_argument('--limit',						type=int, default=None, help="How many rows of input data to read")
+	parser.add_argument('--limit',						type=int, default=None, help="How many rows of input data to read (when training, after any --type-string-prefix filter)")
 	parser.add_argument('--type-string-prefix',			type=str, default=None, help="Filter input data rows to only have this type string prefix")
+	parser.add_argument('--record-format',				type=str, default="tfrecord", choices=["tfrecord", "columns"], help="Store input data as TFRecords, or as memory mapped NumPy columns")
 
 	# --------------------------------------------------------------------------
 	# Data build
@@ -81,6 +94,19 @@ def get_args(extend=lambda parser:None, argv=None):
 	
 	parser.add_argument('--eval-every',					type=int,	default=300, help="How often to evaluate")
 
+	parser.add_argument('--input-threads',				type=int,	default=4, help="How many batches of input to parse in parallel")
+	parser.add_argument('--input-prefetch',				type=int,	default=2, help="How many batches of input to prepare ahead of the training step")
+
+	parser.add_argument('--shuffle-buffer-mb',			type=float, default=64, help="Memory for shuffling serialized input records (never fewer than 16384 of them), on top of shuffling the order of input files, which needs more than one shard")
+
+	parser.add_argument('--cache-input',				action='store_true',  help="Keep parsed train and eval batches on local disk after their first epoch (TFRecords only). The records in each batch are then fixed for the rest of training, only the batch order is shuffled. Eval is only cached if a round reads all of it. Only finished caches are reused, an unfinished one is left on disk and a new one started.")
+	parser.add_argument('--cache-dir',					type=str,	default=os.path.join(tempfile.gettempdir(), "macgraph-cache"), help="Local directory for --cache-input")
+	parser.add_argument('--cache-shuffle-batches',		type=int,	default=100, help="How many cached batches to shuffle between")
+
+	parser.add_argument('--bucket-by-length',			action='store_true',  help="Batch records with similar src and kb_nodes lengths together, to cut padding")
+	parser.add_argument('--bucket-src-width',			type=int,	default=4, help="Range of src lengths in one bucket")
+	parser.add_argument('--bucket-kb-nodes-width',		type=int,	default=8, help="Range of kb_nodes lengths in one bucket")
+
 
 	# --------------------------------------------------------------------------
 	# Network topology
@@ -102,6 +128,14 @@ def get_args(extend=lambda parser:None, argv=None):
 	parser.add_argument('--output-layers',				type=int, default=2)
 	parser.add_argument('--output-classes',	       		type=int, default=128,    help="The number of different possible answers (e.g. answer classes). Currently tied to vocab size since we attempt to tokenise the output.")
 
+	parser.add_argument('--static-shapes',				action='store_true',  help="Pad every batch to --max-seq-len and --kb-node-max-len with a fixed batch size, and skip runtime shape asserts")
+	parser.add_argument('--xla-jit',					action='store_true',  help="Compile the control, read and output cells with XLA")
+
+	parser.add_argument('--assertions',					type=str, default="debug", choices=ASSERTION_LEVELS, help="Build runtime shape and numerics checks into the graph for every step, every --assertion-every steps, or not at all")
+	parser.add_argument('--assertion-every',			type=int, default=100, help="How often to run the checks with --assertions sampled")
+
+	parser.add_argument('--predict-output',				type=str, default="labels", choices=PREDICT_OUTPUTS, help="What PREDICT mode returns per example: the predicted and actual labels, those plus the predicted label's probability, or every feature and attention tap for diagnostics")
+
 	parser.add_argument('--enable-tf-debug', 			action='store_true',  dest="use_tf_debug")
 
 	
@@ -7,37 +7,31 @@ from .args import global_args
 from .const import EPSILON
 
 
+# Added to masked logits, so they vanish from the softmax
+MASK_LOGIT = -1E9
+
 def softmax_with_masking(logits, mask, axis):
+	"""Softmax along axis, where entries with mask False are left out and come out as 0.
+
+	For numerical stability each row has its own max taken off (not one max for the 
+	whole batch, which can underflow every entry of rows with much smaller logits). A 
+	row with every entry masked is all 0s."""
 	with tf.name_scope("softmax_with_masking"):
 		assert mask.dtype == tf.bool
-		mask = dynamic_assert_shape(mask, tf.shape(logits))
 		assert axis < len(logits.shape)
-		logits = tf.check_numerics(logits, "logits")
-
-		# For numerical stability shrink the values
-		logits_max = tf.reduce_max(tf.boolean_mask(logits, mask))
-		logits_max = tf.check_numerics(logits_max, "logit_max")
 
 		f_mask = tf.cast(mask, logits.dtype)
+		masked_logits = logits + (1.0 - f_mask) * MASK_LOGIT
+
+		logits_max = tf.reduce_max(masked_logits, axis, keepdims=True)
 
-		# Numerator
-		l_delta = (logits - logits_max) * f_mask
-		l_delta = tf.check_numerics(l_delta, "l_delta")
+		# Numerator, masked again so fully masked rows are 0 rather than uniform
+		l = tf.exp(masked_logits - tf.stop_gradient(logits_max)) * f_mask
 
-		# This assert fails, howwwww??
-		with tf.control_dependencies([tf.assert_less_equal(l_delta, 0.0, summarize=100000, data=[logits_max, mask, logits])]):
-			
-			l = tf.exp(l_delta)
-			l = tf.check_numerics(l, "numerator pre mask")
-			l *= tf.cast(mask, logits.dtype)
-			l = tf.check_numerics(l, "numerator")
-			
-			# Denominator
-			d = tf.reduce_sum(l, axis) 
-			d = tf.expand_dims(d, axis)
-			d = tf.check_numerics(d, "denominator")
+		# Denominator
+		d = tf.reduce_sum(l, axis, keepdims=True)
 
-			return l / (d + EPSILON)
+		return l / (d + EPSILON)
 
 
 def attention(table:tf.Tensor, query:tf.Tensor, key_width:int=None, keys_len=None, name="attention"):
@@ -86,7 +80,7 @@ def attention_key_value(keys:tf.Tensor, table:tf.Tensor, query:tf.Tensor, key_wi
 
 		output = tf.reduce_sum(weighted_table, 1)
 		output = dynamic_assert_shape(output, [batch_size, value_width], "output")
-		output = tf.check_numerics(output, "attention_output")
+		output = check_numerics(output, "attention_output")
 
 		return output, scores_sm, attn_focus
 
@@ -7,6 +7,7 @@ import numpy as np
 import math
 
 from .attention import *
+from .args import global_args
 
 class TestAttention(unittest.TestCase):
 
@@ -34,6 +35,24 @@ class TestAttention(unittest.TestCase):
 
         np.testing.assert_almost_equal(r, expected)
 
+    def test_softmax_masking_per_row(self):
+
+        # Rows on very different scales, a single max for the batch would underflow the second
+        logits = tf.constant([[1000.0, 999.0, 5.0], [0.0, -1.0, 5.0], [3.0, 2.0, 1.0]])
+        mask = tf.sequence_mask([2, 2, 0], 3)
+
+        r = np.array(softmax_with_masking(logits, mask, 1))
+
+        d = math.exp(0) + math.exp(-1)
+        expected = np.array([
+            [1/d, math.exp(-1)/d, 0],
+            [1/d, math.exp(-1)/d, 0],
+            [0, 0, 0],
+        ])
+
+        self.assertTrue(np.all(np.isfinite(r)))
+        np.testing.assert_almost_equal(r, expected)
+
     def test_softmax_write(self):
 
         max_len = 6
@@ -50,6 +69,24 @@ class TestAttention(unittest.TestCase):
         np.set_printoptions(threshold=np.inf)
         np.testing.assert_almost_equal(table.numpy(), exp)
 
+    def test_assertions_off(self):
+
+        global_args["assertions"] = "off"
+
+        try:
+            with tf.Graph().as_default() as graph:
+                keys = tf.placeholder(tf.float32, [None, None, 4])
+                query = tf.placeholder(tf.float32, [None, 4])
+                keys_len = tf.placeholder(tf.int32, [None])
+
+                attention(keys, query, key_width=4, keys_len=keys_len)
+                op_types = set(op.type for op in graph.get_operations())
+        finally:
+            del global_args["assertions"]
+
+        self.assertNotIn("Assert", op_types)
+        self.assertNotIn("CheckNumerics", op_types)
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,95 @@
+
+import json
+import time
+import argparse
+import numpy as np
+import tensorflow as tf
+
+from .attention import softmax_with_masking
+from .const import EPSILON
+
+# --------------------------------------------------------------------------
+# Microbenchmark of softmax_with_masking against the implementation it
+# replaced (one max for the whole batch via boolean_mask, with numerics
+# checks and asserts), forward and backward, at the shapes the control and
+# read cells use.
+#
+# python -m macgraph.bench_attention --batch-size 32 --seq-len 40
+# --------------------------------------------------------------------------
+
+def softmax_with_masking_global_max(logits, mask, axis):
+	"""The previous implementation, kept here as the baseline"""
+	with tf.name_scope("softmax_with_masking_global_max"):
+		logits = tf.check_numerics(logits, "logits")
+
+		logits_max = tf.reduce_max(tf.boolean_mask(logits, mask))
+		logits_max = tf.check_numerics(logits_max, "logit_max")
+
+		f_mask = tf.cast(mask, logits.dtype)
+
+		l_delta = (logits - logits_max) * f_mask
+		l_delta = tf.check_numerics(l_delta, "l_delta")
+
+		with tf.control_dependencies([tf.assert_less_equal(l_delta, 0.0, summarize=100000, data=[logits_max, mask, logits])]):
+			l = tf.exp(l_delta)
+			l = tf.check_numerics(l, "numerator pre mask")
+			l *= f_mask
+			l = tf.check_numerics(l, "numerator")
+
+			d = tf.reduce_sum(l, axis)
+			d = tf.expand_dims(d, axis)
+			d = tf.check_numerics(d, "denominator")
+
+			return l / (d + EPSILON)
+
+
+IMPLEMENTATIONS = {
+	"global_max": softmax_with_masking_global_max,
+	"per_row": softmax_with_masking,
+}
+
+def bench(fn, batch_size, seq_len, warmup_steps, steps):
+	"""Milliseconds per forward and backward pass of fn"""
+
+	with tf.Graph().as_default():
+		logits = tf.Variable(tf.random_normal([batch_size, seq_len, 1]))
+		lengths = tf.random_uniform([batch_size], 1, seq_len + 1, dtype=tf.int32)
+		mask = tf.expand_dims(tf.sequence_mask(lengths, seq_len), -1)
+
+		scores = fn(logits, mask, 1)
+		grad = tf.gradients(tf.reduce_sum(scores * tf.random_normal(tf.shape(scores))), logits)[0]
+		step = tf.group(scores, grad)
+
+		with tf.Session() as session:
+			session.run(tf.global_variables_initializer())
+
+			for i in range(warmup_steps):
+				session.run(step)
+
+			times = []
+			for i in range(steps):
+				start = time.perf_counter()
+				session.run(step)
+				times.append((time.perf_counter() - start) * 1000)
+
+	return {
+		"mean_ms": float(np.mean(times)),
+		"p50_ms": float(np.percentile(times, 50)),
+	}
+
+
+if __name__ == "__main__":
+
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--batch-size', 	type=int, default=32)
+	parser.add_argument('--seq-len', 		type=int, default=40)
+	parser.add_argument('--warmup-steps', 	type=int, default=50)
+	parser.add_argument('--steps', 			type=int, default=1000)
+	args = vars(parser.parse_args())
+
+	results = {
+		name: bench(fn, args["batch_size"], args["seq_len"], args["warmup_steps"], args["steps"])
+		for name, fn in IMPLEMENTATIONS.items()
+	}
+
+	print(json.dumps({**args, "implementations": results}, indent=2))
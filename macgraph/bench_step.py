@@ -0,0 +1,81 @@
+
+import json
+import time
+import numpy as np
+import tensorflow as tf
+
+from .args import *
+from .input import input_fn
+from .model import model_fn
+
+import logging
+logger = logging.getLogger(__name__)
+
+# --------------------------------------------------------------------------
+# Benchmark training step time on built input data, with the usual dynamic
+# shapes, with --static-shapes and with --static-shapes --xla-jit.
+#
+# python -m macgraph.bench_step --input-dir ./input_data/my_build
+# --------------------------------------------------------------------------
+
+CONFIGS = {
+	"dynamic": 		{"static_shapes": False, "xla_jit": False},
+	"static": 		{"static_shapes": True,  "xla_jit": False},
+	"static_xla": 	{"static_shapes": True,  "xla_jit": True},
+}
+
+def bench(args, warmup_steps, steps):
+	"""Milliseconds per training step, after warmup_steps, for args"""
+
+	# dynamic_assert_shape reads this
+	global_args.clear()
+	global_args.update(args)
+
+	with tf.Graph().as_default():
+		tf.train.get_or_create_global_step()
+
+		features, labels = input_fn(args, "train").make_one_shot_iterator().get_next()
+		spec = model_fn(features, labels, tf.estimator.ModeKeys.TRAIN, args)
+
+		with tf.Session() as session:
+			session.run(tf.global_variables_initializer())
+			session.run(tf.tables_initializer())
+
+			for i in range(warmup_steps):
+				session.run(spec.train_op)
+
+			times = []
+			for i in range(steps):
+				start = time.perf_counter()
+				session.run(spec.train_op)
+				times.append((time.perf_counter() - start) * 1000)
+
+	return {
+		"mean_ms": float(np.mean(times)),
+		"p50_ms": float(np.percentile(times, 50)),
+		"p95_ms": float(np.percentile(times, 95)),
+	}
+
+
+if __name__ == "__main__":
+
+	def extend(parser):
+		parser.add_argument('--bench-warmup-steps', type=int, default=20, help="Steps to run before timing (XLA compiles in these)")
+		parser.add_argument('--bench-steps', 		type=int, default=200)
+
+	args = get_args(extend)
+
+	logging.basicConfig()
+	logger.setLevel(args["log_level"])
+
+	results = {}
+	for name, config in CONFIGS.items():
+		logger.info(f"Benchmarking {name}")
+		results[name] = bench({**args, **config}, args["bench_warmup_steps"], args["bench_steps"])
+
+	print(json.dumps({
+		"input_dir": args["input_dir"],
+		"batch_size": args["batch_size"],
+		"steps": args["bench_steps"],
+		"configs": results,
+	}, indent=2))
@@ -19,29 +19,24 @@ def control_cell(args, features, in_question_tokens):
 
 		control_shape = [ features["d_batch_size"], args["control_width"] ]
 		question_token_width = args["embed_width"]
-		control_query_shape = [ features["d_batch_size"], question_token_width ]
+		heads = args["control_heads"]
 
-		attention_calls = []
-		
-		for i in range(args["control_heads"]):
-			question_token_query = tf.get_variable(f"control_query_{i}", [1, question_token_width])
-			question_token_query = tf.tile(question_token_query, [features["d_batch_size"], 1])
-			question_token_query = dynamic_assert_shape(question_token_query, control_query_shape)
-			
-			a = attention(
-				table=in_question_tokens, 
-				query=question_token_query, 
-				key_width=question_token_width, 
-				keys_len=features["src_len"],
-			)
-			attention_calls.append(a)
-
-		control_out  = [i[0] for i in attention_calls]
-		control_out  = tf.concat(control_out, -1)
-
-		tap_qw_attn = [i[1] for i in attention_calls]
-		tap_qw_attn = tf.concat(tap_qw_attn, -1) # Concat the unitary score dimensions
-		tap_qw_attn = tf.transpose(tap_qw_attn, [0, 2, 1]) # switch so last dimension is words
+		# One query per head, all scored against the question tokens at once
+		control_query = tf.get_variable("control_query", [heads, question_token_width])
+
+		scores = tf.tensordot(in_question_tokens, control_query, [[2], [1]])
+		scores = dynamic_assert_shape(scores, [features["d_batch_size"], features["d_src_len"], heads])
+
+		scores_mask = tf.sequence_mask(features["src_len"], tf.shape(in_question_tokens)[1])
+		scores_mask = tf.expand_dims(scores_mask, -1) # The same for every head
+		scores_sm = softmax_with_masking(scores, mask=scores_mask, axis=1)
+
+		# Each head's attention weighted sum of the tokens, heads laid end to end
+		control_out = tf.matmul(scores_sm, in_question_tokens, transpose_a=True)
+		control_out = tf.reshape(control_out, [-1, heads * question_token_width])
+		control_out = check_numerics(control_out, "control_out")
+
+		tap_qw_attn = tf.transpose(scores_sm, [0, 2, 1]) # switch so last dimension is words
 
 		if control_out.shape[-1] != args["control_width"]:
 			control_out = tf.layers.dense(control_out, args["control_width"], name="resize_control_out")
@@ -49,4 +44,3 @@ def control_cell(args, features, in_question_tokens):
 		control_out = dynamic_assert_shape(control_out, control_shape)
 
 		return control_out, tap_qw_attn
-
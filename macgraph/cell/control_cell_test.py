@@ -0,0 +1,70 @@
+import unittest
+
+import tensorflow as tf
+
+import numpy as np
+
+from .control_cell import control_cell
+from ..attention import attention
+
+class TestControlCell(unittest.TestCase):
+
+    def test_matches_attention_per_head(self):
+
+        # The heads used to be scored with one attention() call each. Scoring them
+        # all at once must give the same output and taps, padding included.
+        batch_size, seq_len, embed_width, heads = 3, 5, 4, 2
+        src_len = [5, 2, 1]
+
+        np.random.seed(0)
+        tokens_value = np.random.randn(batch_size, seq_len, embed_width).astype(np.float32)
+
+        args = {
+            "control_width": heads * embed_width,
+            "embed_width": embed_width,
+            "control_heads": heads,
+        }
+
+        with tf.Graph().as_default():
+            tokens = tf.placeholder(tf.float32, [None, None, embed_width])
+            features = {
+                "d_batch_size": tf.shape(tokens)[0],
+                "d_src_len": tf.shape(tokens)[1],
+                "src_len": tf.constant(src_len),
+            }
+
+            control_out, tap_qw_attn = control_cell(args, features, tokens)
+
+            control_query = [i for i in tf.global_variables() if "control_query" in i.name][0]
+
+            attention_calls = []
+            for i in range(heads):
+                query = tf.tile(control_query[i:i+1], [features["d_batch_size"], 1])
+                attention_calls.append(attention(
+                    table=tokens,
+                    query=query,
+                    key_width=embed_width,
+                    keys_len=features["src_len"]))
+
+            expected_out = tf.concat([i[0] for i in attention_calls], -1)
+            expected_tap = tf.concat([i[1] for i in attention_calls], -1)
+            expected_tap = tf.transpose(expected_tap, [0, 2, 1])
+
+            with tf.Session() as session:
+                session.run(tf.global_variables_initializer())
+                control_out, tap_qw_attn, expected_out, expected_tap = session.run(
+                    [control_out, tap_qw_attn, expected_out, expected_tap],
+                    {tokens: tokens_value})
+
+        self.assertEqual(tap_qw_attn.shape, (batch_size, heads, seq_len))
+
+        np.testing.assert_allclose(control_out, expected_out, rtol=1e-5, atol=1e-6)
+        np.testing.assert_allclose(tap_qw_attn, expected_tap, rtol=1e-5, atol=1e-6)
+
+        # Nothing attends past a row's src_len
+        for row, length in enumerate(src_len):
+            np.testing.assert_allclose(tap_qw_attn[row, :, length:], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,4 +1,5 @@
 
-from .input import input_fn, gen_input_fn
+from .input import input_fn, gen_input_fn, padding_efficiency, EVAL_STEPS
 from .text_util import Vocab, bytes_to_string, pretokenize_json, UNK_ID
-from .kb import get_table_with_embedding
\ No newline at end of file
+from .kb import get_table_with_embedding
+from .type_table import TypeTable
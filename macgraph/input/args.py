@@ -1,11 +1,21 @@
 
 from ..args import get_args as get_args_parent
+from .util import COMPRESSION_EXTENSIONS
 
 def get_args(extend=lambda x:None, argv=None):
 	def inner_extend(parser):
 		parser.add_argument('--skip-vocab', 		action='store_true')
 		parser.add_argument('--gqa-path', 			type=str, default="./input_data/raw/gqa-default.yaml")
 		parser.add_argument('--balance-batch', 		type=int, default=1000)
+		parser.add_argument('--balance-memory-mb', 	type=float, default=512, help="How much record data the balancer holds in memory before spilling to a temporary file")
+		parser.add_argument('--shards', 			type=int, default=1, help="How many TFRecord files to split each mode into")
+		parser.add_argument('--partition-by-type', 	action='store_true', help="Write a separate set of files for each type string, so input with --type-string-prefix only reads the matching ones")
+		parser.add_argument('--compression', 		type=str, default="NONE", choices=COMPRESSION_EXTENSIONS.keys())
+		parser.add_argument('--build-workers', 		type=int, default=1, help="Number of processes generating records (0 for one per core)")
+		parser.add_argument('--incremental', 		action='store_true', help="Only add docs not in a previous build with the same vocab, type table and settings (use with --skip-vocab). Docs edited since are added again, their old records are not removed")
+		parser.add_argument('--single-pass', 		action='store_true', help="Parse the GQA file once, spilling a pre-tokenized copy to disk to generate records from once the vocab is built")
+		parser.add_argument('--profile', 			action='store_true', help="Time each build stage and print the stats as JSON at the end")
+		parser.add_argument('--build-chunk-size', 	type=int, default=100, help="How many docs to send to a build worker at a time")
 		extend(parser)
 
 	return get_args_parent(inner_extend, argv)
\ No newline at end of file
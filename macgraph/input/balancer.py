@@ -1,14 +1,121 @@
 
-import random
 import math
-from collections import Counter
+import itertools
+import pickle
+import tempfile
+import numpy as np
+from collections import Counter, namedtuple
 
 import logging
 logger = logging.getLogger(__name__)
 
+
+SpilledRecord = namedtuple("SpilledRecord", ["id"])
+
+# Don't bother compacting a spill file with less than this free
+COMPACT_MIN_BYTES = 64 * 2**20
+
+def record_size(record):
+	"""Bytes held by a record: a serialized Example, or a tuple of the values
+	themselves (NumPy arrays and scalars) for the columns format"""
+	if isinstance(record, bytes):
+		return len(record)
+
+	return sum(getattr(i, "nbytes", 8) for i in record)
+
+
+class RecordStore(object):
+	"""Holds the records waiting in the balancers. 
+
+	Up to budget bytes are kept in memory, past that records are pickled to a 
+	temporary file. put() returns a handle (the record, or a SpilledRecord) to get() them back by.
+
+	Released records leave holes in the file. Once the holes are over half of it 
+	the live records are copied to a fresh file, and when none are left it's emptied,
+	so the file stays within about twice the size of the records spilled at once.
+	"""
+
+	def __init__(self, budget=None, compact_min_bytes=COMPACT_MIN_BYTES):
+		self.budget = budget
+		self.compact_min_bytes = compact_min_bytes
+		self.in_memory = 0
+		self.file = None
+
+		# (offset, length) in the file of each spilled record, by id
+		self.spilled = {}
+		self.next_id = 0
+		self.file_bytes = 0
+		self.free_bytes = 0
+
+	def put(self, record):
+		size = record_size(record)
+
+		if self.budget is None or self.in_memory + size <= self.budget:
+			self.in_memory += size
+			return record
+
+		if self.file is None:
+			self.file = tempfile.TemporaryFile()
+
+		data = pickle.dumps(record, pickle.HIGHEST_PROTOCOL)
+		self.file.seek(self.file_bytes)
+		self.file.write(data)
+
+		handle = SpilledRecord(self.next_id)
+		self.spilled[handle.id] = (self.file_bytes, len(data))
+		self.next_id += 1
+		self.file_bytes += len(data)
+		return handle
+
+	def get(self, handle):
+		if isinstance(handle, SpilledRecord):
+			offset, length = self.spilled[handle.id]
+			self.file.seek(offset)
+			return pickle.loads(self.file.read(length))
+
+		return handle
+
+	def release(self, handle):
+		"""The balancer no longer holds this record"""
+		if not isinstance(handle, SpilledRecord):
+			self.in_memory -= record_size(handle)
+			return
+
+		offset, length = self.spilled.pop(handle.id)
+		self.free_bytes += length
+
+		if len(self.spilled) == 0:
+			self.file.seek(0)
+			self.file.truncate()
+			self.file_bytes = 0
+			self.free_bytes = 0
+
+		elif self.free_bytes > max(self.file_bytes / 2, self.compact_min_bytes):
+			self.compact()
+
+	def compact(self):
+		"""Copy the live records to a new file, dropping the holes"""
+		compacted = tempfile.TemporaryFile()
+
+		for i, (offset, length) in sorted(self.spilled.items(), key=lambda i: i[1][0]):
+			self.file.seek(offset)
+			self.spilled[i] = (compacted.tell(), length)
+			compacted.write(self.file.read(length))
+
+		self.file.close()
+		self.file = compacted
+		self.file_bytes = compacted.tell()
+		self.free_bytes = 0
+
+	def close(self):
+		if self.file is not None:
+			self.file.close()
+			self.file = None
+
+
 class Balancer(object):
 
-	def __init__(self, partitioner, balance_freq, name="", parent=None):
+	def __init__(self, partitioner, balance_freq, name="", parent=None, store=None):
 		self.batch_i = 0
 		self.partitioner = partitioner
 		self.balance_freq = balance_freq
@@ -16,6 +123,10 @@ class Balancer(object):
 		self.parent = parent
 		self.running_total = None
 
+		if store is None:
+			store = parent.store if parent is not None else RecordStore()
+		self.store = store
+
 	def oversampled_so_far(self):
 		raise NotImplementedException()
 
@@ -30,8 +141,8 @@ class Balancer(object):
 			self.pipe_if_ready()
 
 	def pipe(self):
-		for i in self.oversample(self.batch_i):
-			self.partitioner.write(*i)
+		for doc, handle in self.oversample(self.batch_i):
+			self.partitioner.write(doc, self.store.get(handle))
 
 	def pipe_if_ready(self):
 		if self.batch_i > self.balance_freq:
@@ -44,48 +155,69 @@ class Balancer(object):
 	def __exit__(self, *vargs):
 		if self.parent is None:
 			self.pipe()
+			self.store.close()
 			print(self.running_total)
 
 
-def resample_list(l, n):
+def resample_indices(size, n):
+	"""Indices that resample a list of length size to n items: every item if 
+	n >= size (topped up with random picks), otherwise a random subset"""
+
 	if n < 0:
-		raise ArgumentError("Cannot sample list to negative size")
+		raise ValueError("Cannot sample list to negative size")
 	elif n == 0:
-		r = []
-	elif n == len(l):
-		r = l
-	elif n >= len(l):
-		r = l + [random.choice(l) for i in range(n - len(l))]
+		r = np.zeros([0], dtype=np.int64)
+	elif size == 0:
+		raise ValueError("Cannot sample empty list")
+	elif n == size:
+		r = np.arange(size)
+	elif n > size:
+		r = np.concatenate([np.arange(size), np.random.randint(size, size=n - size)])
 	else:
-		r = random.sample(l, n)
+		r = np.random.choice(size, n, replace=False)
 
 	assert len(r) == n
 	return r
 
 
+def resample_list(l, n):
+	return [l[i] for i in resample_indices(len(l), n)]
+
+
 class ListBalancer(Balancer):
+	"""Keeps the most recent balance_freq items in a ring buffer, which grows as 
+	items arrive so a rare class only takes the room it needs.
 
-	def __init__(self, partitioner, balance_freq, name="", parent=None):
-		super().__init__(partitioner, balance_freq, name, parent)
+	Each slot holds the item's doc (its keys, which are small) and the record's
+	handle in the store."""
+
+	def __init__(self, partitioner, balance_freq, name="", parent=None, store=None):
+		super().__init__(partitioner, balance_freq, name, parent, store)
 		self.data = []
+		self.head = 0 # Next slot to write to, once full
 
 	def add(self, doc, item):
-		self.data.append((doc,item))
-		self.data = self.data[-self.balance_freq:]
+		if len(self.data) < self.balance_freq:
+			self.data.append((doc, self.store.put(item)))
+		else:
+			# Release first, so the store has the room back before the put
+			self.store.release(self.data[self.head][1])
+			self.data[self.head] = (doc, self.store.put(item))
+			self.head = (self.head + 1) % self.balance_freq
+
 		super().add(doc, item)
 
 	def oversample(self, n):
 		if len(self.data) == 0:
 			raise ValueError("Cannot sample empty list")
 		
-		r = resample_list(self.data, n)
-		return r
+		return [self.data[i] for i in resample_indices(len(self.data), n)]
 
 
 class DictBalancer(Balancer):
 
-	def __init__(self, key_pred, CtrClzz, partitioner, balance_freq, name="", parent=None):
-		super().__init__(partitioner, balance_freq, name, parent)
+	def __init__(self, key_pred, CtrClzz, partitioner, balance_freq, name="", parent=None, store=None):
+		super().__init__(partitioner, balance_freq, name, parent, store)
 		self.data = {}
 		self.key_pred = key_pred
 		self.CtrClzz = CtrClzz
@@ -119,17 +251,25 @@ class DictBalancer(Balancer):
 		if n <= 0:
 			return []
 
-		r = []
+		keys = list(self.running_total.keys())
+
+		# A class that arrived late can leave older classes above target, they just get no more
+		per_class = [
+			self.data[k].oversample(max(0, target_per_class - self.running_total[k]))
+			for k in keys
+		]
+		candidates = list(itertools.chain.from_iterable(per_class))
+
+		picked = resample_indices(len(candidates), n)
 
-		for k, v in self.running_total.items():
-			o = self.data[k].oversample(target_per_class - v)
-			o = [(k, i) for i in o]
-			r.extend(o)
+		# Work out which class each picked candidate came from, to update the totals
+		class_ends = np.cumsum([len(i) for i in per_class])
+		picked_classes = np.searchsorted(class_ends, picked, side="right")
 
-		r = resample_list(r, n)
+		for k, c in zip(keys, np.bincount(picked_classes, minlength=len(keys))):
+			self.running_total[k] += int(c)
 
-		classes, r = zip(*r) # aka unzip
-		self.running_total.update(classes)
+		r = [candidates[i] for i in picked]
 
 		assert len(r) == n, f"DictBalancer {self.name} tried to return {len(r)} not {n} items"
 		assert sum(self.running_total.values()) == total_target
@@ -137,7 +277,7 @@ class DictBalancer(Balancer):
 
 
 class TwoLevelBalancer(DictBalancer):
-	def __init__(self, key1, key2, partitioner, balance_freq, name="TwoLevelBalancer", parent=None):
+	def __init__(self, key1, key2, partitioner, balance_freq, name="TwoLevelBalancer", parent=None, store=None):
 		Inner = lambda partitioner, balance_freq, name, parent: DictBalancer(key2, ListBalancer, partitioner, balance_freq, name, parent)
-		super().__init__(key1, Inner, partitioner, balance_freq, name, parent)
+		super().__init__(key1, Inner, partitioner, balance_freq, name, parent, store)
 
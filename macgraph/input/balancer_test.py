@@ -0,0 +1,95 @@
+import unittest
+
+from collections import Counter
+
+from .balancer import *
+
+class RecordingPartitioner(object):
+
+    def __init__(self):
+        self.written = []
+
+    def write(self, doc, record):
+        self.written.append((doc, record))
+
+
+class TestBalancer(unittest.TestCase):
+
+    def test_list_balancer_keeps_latest(self):
+        balancer = ListBalancer(RecordingPartitioner(), 5)
+
+        for i in range(12):
+            balancer.add("doc", bytes([i]))
+
+        self.assertEqual(sorted(i[0] for _, i in balancer.oversample(5)), list(range(7, 12)))
+        self.assertEqual(len(balancer.oversample(3)), 3)
+
+        oversampled = balancer.oversample(9)
+        self.assertEqual(len(oversampled), 9)
+        self.assertTrue(set(i[0] for _, i in oversampled) <= set(range(7, 12)))
+
+    def test_resample_indices(self):
+        self.assertEqual(list(resample_indices(4, 4)), [0, 1, 2, 3])
+        self.assertEqual(len(set(resample_indices(10, 4))), 4)
+        self.assertEqual(sorted(set(resample_indices(3, 7))), [0, 1, 2])
+
+        with self.assertRaises(ValueError):
+            resample_indices(0, 2)
+
+    def test_two_level_balances_classes(self):
+        partitioner = RecordingPartitioner()
+
+        # Heavily skewed input
+        docs = ([("a", "p")] * 8 + [("b", "p"), ("b", "q")]) * 30
+
+        with TwoLevelBalancer(lambda d: d[0], lambda d: d[1], partitioner, 50) as balancer:
+            for idx, doc in enumerate(docs):
+                balancer.add(doc, str(idx).encode())
+
+        self.assertEqual(len(partitioner.written), len(docs))
+        self.assertEqual(sum(balancer.running_total.values()), len(docs))
+
+        written = Counter(doc for doc, _ in partitioner.written)
+        self.assertLessEqual(abs(written[("a", "p")] - written[("b", "p")] - written[("b", "q")]), 2)
+        self.assertLessEqual(abs(written[("b", "p")] - written[("b", "q")]), 2)
+
+        for doc, record in partitioner.written:
+            self.assertEqual(docs[int(record)], doc)
+
+    def test_record_store_spills(self):
+        store = RecordStore(budget=10)
+
+        handles = [store.put(bytes([i]) * 4) for i in range(5)]
+
+        self.assertEqual(store.in_memory, 8)
+        self.assertEqual([store.get(h) for h in handles], [bytes([i]) * 4 for i in range(5)])
+
+        store.release(handles[0])
+        self.assertEqual(store.in_memory, 4)
+        self.assertEqual(store.get(store.put(b"abcd")), b"abcd")
+        self.assertEqual(store.in_memory, 8)
+
+        # Once every spilled record is released the file is emptied
+        for h in handles[2:]:
+            store.release(h)
+        self.assertEqual(store.file_bytes, 0)
+
+        store.close()
+
+    def test_record_store_compacts(self):
+        store = RecordStore(budget=0, compact_min_bytes=0)
+
+        handles = [store.put(bytes([i]) * 100) for i in range(10)]
+        size = store.file_bytes
+
+        for h in handles[:6]:
+            store.release(h)
+
+        self.assertLess(store.file_bytes, size)
+        self.assertEqual([store.get(h) for h in handles[6:]], [bytes([i]) * 100 for i in range(6, 10)])
+
+        store.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
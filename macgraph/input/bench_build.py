@@ -0,0 +1,117 @@
+
+import sys
+import json
+import contextlib
+import os.path
+import tempfile
+import tensorflow as tf
+
+from .args import *
+from .util import *
+from .text_util import *
+from .graph_util import *
+from .build import serialize_record, check_label, doc_keys
+from .balancer import TwoLevelBalancer, RecordStore
+from .profiler import StageProfiler
+from .type_table import TypeTable
+
+import logging
+logger = logging.getLogger(__name__)
+
+# --------------------------------------------------------------------------
+# Benchmark each stage of build on a fixed input, one stage at a time so
+# that the growth in RSS over each stage (rss_delta_mb) is its own. The
+# report is the only thing written to stdout.
+#
+# python -m macgraph.input.bench_build --gqa-path my.yaml --limit 10000
+# --------------------------------------------------------------------------
+
+class CountingPartitioner(object):
+	"""Stands in for Partitioner so the balancer stage doesn't include writing"""
+
+	def __init__(self):
+		self.written = 0
+
+	def write(self, keys, record):
+		self.written += 1
+
+
+def bench(args, vocab):
+	profiler = StageProfiler()
+
+	with profiler.measure_rss("read_gqa"):
+		docs = list(profiler.iterate("read_gqa", read_gqa(args)))
+	
+	questions = []
+	with profiler.measure_rss("english_to_ids"):
+		for doc in docs:
+			with profiler("english_to_ids"):
+				questions.append(vocab.english_to_ids(doc["question"]["english"]))
+
+	tables = []
+	with profiler.measure_rss("graph_to_table"):
+		for doc in docs:
+			with profiler("graph_to_table"):
+				tables.append(graph_to_table(args, vocab, doc["graph"]))
+
+	types = TypeTable.from_types(doc["question"]["type_string"] for doc in docs)
+
+	records = []
+	with profiler.measure_rss("serialize"):
+		for doc, q, nodes in zip(docs, questions, tables):
+			try:
+				label = vocab.lookup(pretokenize_json(doc["answer"]))
+				check_label(args, label, doc["answer"])
+			except ValueError:
+				continue
+
+			with profiler("serialize"):
+				records.append((doc_keys(doc), serialize_record(args, vocab, types, q, label, nodes, doc["question"]["type_string"])))
+
+	with profiler.measure_rss("balancer"):
+		with TwoLevelBalancer(lambda k: k[0], lambda k: k[1], CountingPartitioner(), min_none(args["balance_batch"], args["limit"]), store=RecordStore()) as balancer:
+			for keys, record in records:
+				with profiler("balancer"):
+					balancer.add(keys, record)
+
+	with tempfile.TemporaryDirectory() as tmp:
+		compression = args["compression"]
+		path = os.path.join(tmp, "bench.tfrecords" + COMPRESSION_EXTENSIONS[compression])
+
+		with profiler.measure_rss("write"):
+			with tf.python_io.TFRecordWriter(path, options=record_options(compression)) as writer:
+				for _, record in records:
+					with profiler("write"):
+						writer.write(record)
+
+	return profiler.report()
+
+
+if __name__ == "__main__":
+
+	args = get_args()
+
+	logging.basicConfig()
+	logger.setLevel(args["log_level"])
+
+	# A fixed, modest input unless told otherwise
+	if args["limit"] is None:
+		args["limit"] = 1000
+
+	if tf.gfile.Exists(args["vocab_path"]):
+		vocab = Vocab.load(args)
+	else:
+		logger.info(f"No vocab at {args['vocab_path']}, building one from the input")
+		args["vocab_path"] = os.path.join(tempfile.mkdtemp(), "vocab.txt")
+		vocab = Vocab.build(args, lambda i:gqa_to_tokens(args, i))
+
+	# Keep stdout clean JSON (the balancer prints its totals)
+	with contextlib.redirect_stdout(sys.stderr):
+		stages = bench(args, vocab)
+
+	print(json.dumps({
+		"gqa_path": args["gqa_path"],
+		"limit": args["limit"],
+		"stages": stages,
+	}, indent=2))
+
@@ -1,7 +1,12 @@
 
 import tensorflow as tf
+import numpy as np
 import pathlib
-from collections import Counter
+import os
+import json
+import multiprocessing
+import itertools
+from collections import Counter, deque
 import yaml
 from tqdm import tqdm
 
@@ -9,7 +14,12 @@ from .graph_util import *
 from .text_util import *
 from .util import *
 from .args import *
-from .balancer import TwoLevelBalancer
+from .balancer import TwoLevelBalancer, RecordStore
+from .intermediate import Interner, Spill, doc_to_intermediate
+from .type_table import TypeTable
+from .columns import ColumnRecord
+from .profiler import StageProfiler, NO_PROFILER
+from .manifest import Manifest, doc_hash, load_doc_hashes, save_doc_hashes, remove_doc_hashes
 
 import logging
 logger = logging.getLogger(__name__)
@@ -20,20 +30,15 @@ logger = logging.getLogger(__name__)
 # --------------------------------------------------------------------------
 
 
-def generate_record(args, vocab, doc):
-
-	q = vocab.english_to_ids(doc["question"]["english"])
-
-	# May raise exception if unsupported type
-	label = vocab.lookup(pretokenize_json(doc["answer"]))
-
+def check_label(args, label, answer):
 	if label == UNK_ID:
-		raise ValueError(f"We're only including questions that have in-vocab answers ({doc['answer']})")
+		raise ValueError(f"We're only including questions that have in-vocab answers ({answer})")
 
 	if label >= args["output_classes"]:
 		raise ValueError(f"Label {label} greater than answer classes {args['output_classes']}")
 
-	nodes = graph_to_table(args, vocab, doc["graph"])
+
+def serialize_record(args, vocab, types, q, label, nodes, type_string):
 
 	logger.debug(f"""
 Answer={vocab.ids_to_string([label])} 
@@ -46,60 +51,343 @@ Answer={vocab.ids_to_string([label])}
 		"kb_nodes": 			write_int64_array_feature(nodes.flatten()),
 		"kb_nodes_len": 		write_int64_feature(nodes.shape[0]),		
 		"label": 				write_int64_feature(label),
-		"type_string":			write_string_feature(doc["question"]["type_string"]),
+		"type_string":			write_string_feature(type_string),
+		"type_id":				write_int64_feature(types.strict_lookup(type_string)),
 	}
 
 	example = tf.train.Example(features=tf.train.Features(feature=feature))
 	return example.SerializeToString()
 
 
-def build(args):
-	try:
-		pathlib.Path(args["input_dir"]).mkdir(parents=True, exist_ok=True)
-	except FileExistsError:
-		pass
+def make_record(args, vocab, types, q, label, nodes, type_string):
+	"""A serialized Example, or for the columns format the values themselves, 
+	which ColumnWriter takes without parsing anything"""
 
-	if not args["skip_vocab"]:
-		logger.info("Build vocab")
-		vocab = Vocab.build(args, lambda i:gqa_to_tokens(args, i))
-		logger.info(f"Wrote {len(vocab)} vocab entries")
-		logger.debug(f"vocab: {vocab.table}")
-		print()
-	else:
-		vocab = Vocab.load(args)
+	if args["record_format"] == "columns":
+		return ColumnRecord(
+			np.asarray(q, dtype=np.int32), 
+			nodes.flatten().astype(np.int32), 
+			label, 
+			types.strict_lookup(type_string))
+
+	return serialize_record(args, vocab, types, q, label, nodes, type_string)
+
+
+def generate_record(args, vocab, types, doc, profiler=NO_PROFILER):
+
+	with profiler("english_to_ids"):
+		q = vocab.english_to_ids(doc["question"]["english"])
+
+	# May raise exception if unsupported type
+	label = vocab.lookup(pretokenize_json(doc["answer"]))
+	check_label(args, label, doc["answer"])
+
+	with profiler("graph_to_table"):
+		nodes = graph_to_table(args, vocab, doc["graph"])
+
+	with profiler("serialize"):
+		return make_record(args, vocab, types, q, label, nodes, doc["question"]["type_string"])
+
+
+def generate_record_from_intermediate(args, vocab, types, interned, remap, item, profiler=NO_PROFILER):
+	"""Same as generate_record, for a doc spilled by a single pass build"""
+
+	keys, question, answer, nodes = item
+
+	with profiler("english_to_ids"):
+		q = list(vocab.pretokenized_english_to_ids(interned[question]))
+
+	if answer is None:
+		raise ValueError("Unsupported json value type")
+
+	label = remap[answer]
+	check_label(args, label, keys[0])
+
+	with profiler("graph_to_table"):
+		nodes = pack_table(args, remap[nodes])
+		assert nodes.shape[0] <= args["kb_node_max_len"]
+
+	with profiler("serialize"):
+		return make_record(args, vocab, types, q, label, nodes, keys[1])
+
+
+# Where skip_known_docs leaves a doc's hash, so doc_keys doesn't hash it again
+DOC_HASH_KEY = "_doc_hash"
+
+def doc_keys(doc):
+	"""The (answer, type_string, doc_hash) of a doc: all the balancer and 
+	partitioner need to keep. The hash decides the doc's mode and shard."""
+	h = doc.pop(DOC_HASH_KEY, None) or doc_hash(doc)
+	return (doc["answer"], doc["question"]["type_string"], h)
+
+
+def record_generator(args, vocab, types, interned=None, profiler=NO_PROFILER):
+	"""Returns a function from doc to (doc_keys, record). 
+
+	If interned (the Interner tokens of a single pass build) is given, the 
+	function takes spilled intermediate docs instead of parsed ones."""
+
+	if interned is None:
+		return lambda doc: (doc_keys(doc), generate_record(args, vocab, types, doc, profiler))
+	
+	remap = vocab.lookup_batch(interned)
+	return lambda item: (item[0], generate_record_from_intermediate(args, vocab, types, interned, remap, item, profiler))
+
+
+def generate_records(docs, generate):
+	"""Yields (doc_keys, record) for each doc that can be turned into a record"""
+	for doc in docs:
+		try:
+			yield generate(doc)
+
+		except ValueError as ex:
+			logger.debug(ex)
+			pass
+
+
+# --------------------------------------------------------------------------
+# Multi-process record generation
+# --------------------------------------------------------------------------
+
+# Each worker process loads the vocab once, then re-uses it for every chunk
+_worker_state = {}
+
+def _init_worker(args, interned):
+	_worker_state["profiler"] = StageProfiler(args["profile"])
+	_worker_state["generate"] = record_generator(args, Vocab.load(args), TypeTable.load(args), interned, _worker_state["profiler"])
+
+def _generate_chunk(docs):
+	records = list(generate_records(docs, _worker_state["generate"]))
+	return records, _worker_state["profiler"].drain()
+
+
+def generate_records_parallel(args, docs, workers, interned=None, profiler=NO_PROFILER):
+	"""Like generate_records, but fans chunks of docs out to a pool of worker processes.
+
+	Results come back in input order, and only a bounded number of chunks are
+	in flight at once so we never read the whole dataset into memory.
+	"""
+
+	def collect(result):
+		records, stages = result.get()
+		profiler.merge(stages)
+		return records
+
+	with multiprocessing.Pool(workers, initializer=_init_worker, initargs=(args, interned)) as pool:
+		pending = deque()
+
+		for chunk in chunked(docs, args["build_chunk_size"]):
+			pending.append(pool.apply_async(_generate_chunk, (chunk,)))
 
+			if len(pending) >= workers * 2:
+				yield from collect(pending.popleft())
 
+		while len(pending) > 0:
+			yield from collect(pending.popleft())
+
+
+# --------------------------------------------------------------------------
+# Build stages
+# --------------------------------------------------------------------------
+
+def single_pass(args, spill, profiler=NO_PROFILER):
+	"""Parse every doc once, counting vocab tokens and spilling the 
+	intermediate form of each doc. Returns the counts, interned strings and 
+	question types."""
+
+	hits = Counter()
+	interner = Interner()
+	types = set()
+
+	for doc in profiler.iterate("read_gqa", tqdm(read_gqa(args), total=args["limit"])):
+		# Tokenized once for both the counts and the spill
+		question = pretokenize_english(doc["question"]["english"])
+
+		Vocab.count_tokens(hits, gqa_to_tokens(args, doc, question))
+		types.add(doc["question"]["type_string"])
+		spill.write((doc_keys(doc), *doc_to_intermediate(interner, doc, question)))
+
+	return hits, interner.tokens, types
+
+
+def skip_known_docs(docs, known_hashes, new_hashes):
+	"""Drop docs whose hash is in known_hashes, recording the hashes of the rest in new_hashes"""
+	for doc in docs:
+		h = doc_hash(doc)
+		if h not in known_hashes:
+			new_hashes.append(h)
+			doc[DOC_HASH_KEY] = h
+			yield doc
+
+
+def build_settings(args, types):
+	"""The args that decide what a build's records hold and where they're 
+	written. Generations of an incremental build can only be mixed if these match."""
+	return {
+		"record_format": args["record_format"],
+		"shards": args["shards"],
+		"compression": args["compression"],
+		"partition_by_type": args["partition_by_type"],
+		"eval_holdback": args["eval_holdback"],
+		"predict_holdback": args["predict_holdback"],
+		"kb_node_width": args["kb_node_width"],
+		"types": types.fingerprint(),
+	}
+
+
+def write_records(args, vocab, types, docs, interned=None, profiler=NO_PROFILER):
+	
 	question_types = Counter()
 	output_classes = Counter()
 
-	logger.info("Generate TFRecords")
-	with Partitioner(args) as p:
-		with TwoLevelBalancer(lambda d: d["answer"], lambda d: d["question"]["type_string"], p, min_none(args["balance_batch"], args["limit"])) as balancer:
-			for doc in tqdm(read_gqa(args), total=args["limit"]):
-				try:
-					record = generate_record(args, vocab, doc)
-					question_types[doc["question"]["type_string"]] += 1
-					output_classes[doc["answer"]] += 1
-					balancer.add(doc, record)
+	docs = profiler.iterate("read_gqa" if interned is None else "read_spill", docs)
+
+	# --------------------------------------------------------------------------
+	# For incremental builds, work out which docs are already built
+	# --------------------------------------------------------------------------
+
+	manifest = None
+	new_hashes = []
+	settings = build_settings(args, types)
+
+	if args["incremental"]:
+		manifest = Manifest.load(args)
+		known_hashes = load_doc_hashes(args)
+
+		if (manifest is not None and known_hashes is not None and 
+			manifest["vocab"] == vocab.fingerprint() and manifest.data.get("settings") == settings):
+			logger.info(f"Incremental build, skipping {len(known_hashes)} docs already built")
+		else:
+			logger.info("No incremental build with this vocab and these settings to add to, building everything")
+			manifest = None
+			known_hashes = set()
+
+		docs = skip_known_docs(docs, known_hashes, new_hashes)
 
-				except ValueError as ex:
-					logger.debug(ex)
-					pass
+		if manifest is not None:
+			first = next(docs, None)
 
+			if first is None:
+				logger.info("No new docs, leaving the build as it is")
+				return
 
-		with tf.gfile.GFile(args["answer_classes_path"], "w") as file:
-			yaml.dump(dict(p.answer_classes), file)
+			docs = itertools.chain([first], docs)
+			manifest["generation"] += 1
 
-		with tf.gfile.GFile(args["answer_classes_types_path"], "w") as file:
-			yaml.dump(dict(p.answer_classes_types), file)
+	else:
+		# The records are all being rewritten, so these no longer describe them
+		remove_doc_hashes(args)
+
+	if manifest is None:
+		manifest = Manifest.new(vocab, settings)
+
+	if manifest["generation"] == 0:
+		# Generation 0 replaces every record file, and a failed build removes the 
+		# ones it wrote, so until this build saves its own the old manifest would 
+		# describe files that are gone. Readers fall back to counting records.
+		Manifest.remove(args)
+
+	# --------------------------------------------------------------------------
+	# Generate and write records
+	# --------------------------------------------------------------------------
+
+	workers = args["build_workers"] or os.cpu_count()
+
+	if workers > 1:
+		logger.info(f"Generate TFRecords using {workers} worker processes")
+		records = generate_records_parallel(args, docs, workers, interned, profiler)
+	else:
+		logger.info("Generate TFRecords")
+		records = generate_records(docs, record_generator(args, vocab, types, interned, profiler))
+
+	store = RecordStore(args["balance_memory_mb"] * 2**20 if args["balance_memory_mb"] is not None else None)
+
+	with Partitioner(args, manifest["generation"], profiler) as p:
+		with TwoLevelBalancer(lambda k: k[0], lambda k: k[1], p, min_none(args["balance_batch"], args["limit"]), store=store) as balancer:
+			for keys, record in records:
+				answer, type_string, _ = keys
+				question_types[type_string] += 1
+				output_classes[answer] += 1
+
+				# Includes the writes of any records the balancer pipes out
+				with profiler("balancer"):
+					balancer.add(keys, record)
 
 		logger.info(f"Class distribution: {p.answer_classes}")
 
 		logger.info(f"Wrote {p.written} TFRecords")
 
+	# --------------------------------------------------------------------------
+	# Write out stats (the totals over all generations of an incremental build)
+	# --------------------------------------------------------------------------
+
+	manifest.add_counts(question_types, p.answer_classes, p.answer_classes_types)
+	manifest.add_files(p.shards_written)
+	manifest.save(args)
+
+	if args["incremental"]:
+		save_doc_hashes(args, new_hashes, append=manifest["generation"] > 0)
+
+	with tf.gfile.GFile(args["answer_classes_path"], "w") as file:
+		yaml.dump(manifest["answer_classes"], file)
+
+	with tf.gfile.GFile(args["answer_classes_types_path"], "w") as file:
+		yaml.dump(manifest.answer_classes_types(), file)
 		
 	with tf.gfile.GFile(args["question_types_path"], "w") as file:
-		yaml.dump(dict(question_types), file)
+		yaml.dump(manifest["question_types"], file)
+
+
+def build(args):
+	profiler = StageProfiler(args["profile"])
+
+	try:
+		pathlib.Path(args["input_dir"]).mkdir(parents=True, exist_ok=True)
+	except FileExistsError:
+		pass
+
+	if args["incremental"] and not args["skip_vocab"]:
+		raise ValueError("Incremental builds need the vocab to stay fixed, use --skip-vocab")
+
+	if args["record_format"] == "columns" and args["compression"] != "NONE":
+		raise ValueError("Columns are memory mapped so can't be compressed")
+
+	if args["skip_vocab"]:
+		vocab = Vocab.load(args)
+		types = TypeTable.load(args)
+		write_records(args, vocab, types, tqdm(read_gqa(args), total=args["limit"]), profiler=profiler)
+
+	elif args["single_pass"]:
+		with Spill() as spill:
+			logger.info("Parse docs and build vocab")
+			hits, interned, type_strings = single_pass(args, spill, profiler)
+			vocab = Vocab.from_counts(args, hits)
+			types = TypeTable.from_types(type_strings)
+			types.save(args)
+			logger.info(f"Wrote {len(vocab)} vocab entries and {len(types)} question types, spilled {len(spill)} docs")
+			print()
+
+			write_records(args, vocab, types, tqdm(spill, total=len(spill)), interned, profiler)
+
+	else:
+		logger.info("Build vocab")
+		type_strings = set()
+
+		def doc_tokens(doc):
+			type_strings.add(doc["question"]["type_string"])
+			return gqa_to_tokens(args, doc)
+
+		vocab = Vocab.build(args, doc_tokens)
+		types = TypeTable.from_types(type_strings)
+		types.save(args)
+		logger.info(f"Wrote {len(vocab)} vocab entries and {len(types)} question types")
+		logger.debug(f"vocab: {vocab.table}")
+		print()
+
+		write_records(args, vocab, types, tqdm(read_gqa(args), total=args["limit"]), profiler=profiler)
+
+	if args["profile"]:
+		print(json.dumps(profiler.report(), indent=2))
 
 
 # --------------------------------------------------------------------------
@@ -117,8 +405,3 @@ if __name__ == "__main__":
 	build(args)
 
 	
-
-
-
-
-
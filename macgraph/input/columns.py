@@ -0,0 +1,213 @@
+
+import os
+import os.path
+import shutil
+import struct
+import numpy as np
+from collections import namedtuple
+
+# --------------------------------------------------------------------------
+# A columnar alternative to TFRecords.
+#
+# Each mode (and shard) is a directory of .npy files: the src tokens and
+# kb_nodes rows of every record laid end to end, with offset tables saying
+# where each record starts, plus a label and type id per record.
+#
+# Reading memory maps the arrays, so there is nothing to parse and
+# several training processes on one host share the same page cache. This
+# means the files need to be on a local filesystem.
+# --------------------------------------------------------------------------
+
+COLUMNS_EXTENSION = ".columns"
+
+# The values of one record, what ColumnWriter takes (kb_nodes flattened)
+ColumnRecord = namedtuple("ColumnRecord", ["src", "kb_nodes", "label", "type_id"])
+
+# Each column's dtype and whether its rows are kb_node_width wide
+COLUMN_DTYPES = {
+	"src": 				(np.int32, False),
+	"src_offsets": 		(np.int64, False),
+	"kb_nodes": 		(np.int32, True),
+	"kb_nodes_offsets": (np.int64, False),
+	"label": 			(np.int32, False),
+	"type_id": 			(np.int32, False),
+}
+
+# Room left at the start of each file for its .npy header, written on close
+# once the shape is known
+NPY_HEADER_BYTES = 128
+
+def npy_header(dtype, shape):
+	"""A version 1.0 .npy header padded out to NPY_HEADER_BYTES"""
+	header = "{'descr': %r, 'fortran_order': False, 'shape': %r, }" % (np.dtype(dtype).str, tuple(shape))
+	header = header.ljust(NPY_HEADER_BYTES - 11) + "\n"
+	return b"\x93NUMPY\x01\x00" + struct.pack("<H", len(header)) + header.encode("latin1")
+
+
+class ColumnWriter(object):
+	"""Appends each record to the column files as it arrives, so a shard is never 
+	held in memory. Takes ColumnRecords where a TFRecordWriter takes serialized records."""
+
+	def __init__(self, path, kb_node_width):
+		self.path = path
+		self.kb_node_width = kb_node_width
+
+		os.makedirs(path, exist_ok=True)
+
+		self.files = {}
+		self.lengths = {}
+
+		for name in COLUMN_DTYPES.keys():
+			self.files[name] = open(os.path.join(path, name + ".npy"), "wb")
+			self.files[name].write(bytes(NPY_HEADER_BYTES))
+			self.lengths[name] = 0
+
+		# Offsets of kb_nodes count rows, not ids
+		self.extend("src_offsets", [0])
+		self.extend("kb_nodes_offsets", [0])
+
+	def extend(self, name, values):
+		values = np.asarray(values, dtype=COLUMN_DTYPES[name][0])
+		self.files[name].write(values.tobytes())
+		self.lengths[name] += values.size
+
+	def write(self, record):
+		self.append(*record)
+
+	def append(self, src, kb_nodes, label, type_id):
+		"""Add a record, kb_nodes flattened"""
+		self.extend("src", src)
+		self.extend("src_offsets", [self.lengths["src"]])
+
+		self.extend("kb_nodes", kb_nodes)
+		self.extend("kb_nodes_offsets", [self.lengths["kb_nodes"] // self.kb_node_width])
+
+		self.extend("label", [label])
+		self.extend("type_id", [type_id])
+
+	def close(self):
+		for name, (dtype, rows) in COLUMN_DTYPES.items():
+			length = self.lengths[name]
+			shape = [length // self.kb_node_width, self.kb_node_width] if rows else [length]
+
+			file = self.files[name]
+			file.seek(0)
+			file.write(npy_header(dtype, shape))
+			file.close()
+
+
+def remove_columns(path):
+	shutil.rmtree(path)
+
+def columns_size(path):
+	return sum(os.path.getsize(os.path.join(path, i)) for i in os.listdir(path))
+
+
+class Columns(object):
+	"""The memory mapped columns of one directory"""
+
+	def __init__(self, path):
+		def load(name):
+			return np.load(os.path.join(path, name + ".npy"), mmap_mode="r")
+
+		self.src = load("src")
+		self.src_offsets = load("src_offsets")
+		self.kb_nodes = load("kb_nodes")
+		self.kb_nodes_offsets = load("kb_nodes_offsets")
+		self.label = load("label")
+		self.type_id = load("type_id")
+
+	def __len__(self):
+		return len(self.label)
+
+	def matching(self, type_ids):
+		"""Mask of the records with one of type_ids, or all of them if None"""
+		if type_ids is None:
+			return np.ones(len(self), dtype=bool)
+
+		return np.isin(self.type_id, type_ids)
+
+
+class ColumnReader(object):
+	"""Padded batches drawn from the columns of several directories"""
+
+	def __init__(self, paths, kb_node_width, type_ids=None, limit=None, bucket=None):
+		"""bucket, if given, maps arrays of (src_len, kb_nodes_len) to a bucket id 
+		for each record, and batches are only drawn from one bucket"""
+		self.kb_node_width = kb_node_width
+		self.columns = [Columns(i) for i in paths]
+
+		# (directory, row) of every record to read, limit applies after
+		# the type filter like it does for TFRecords
+		file = np.concatenate([np.full(len(c), n, dtype=np.int64) for n, c in enumerate(self.columns)])
+		row = np.concatenate([np.arange(len(c), dtype=np.int64) for c in self.columns])
+		keep = np.concatenate([c.matching(type_ids) for c in self.columns])
+
+		self.file = file[keep][:limit]
+		self.row = row[keep][:limit]
+
+		if bucket is None:
+			self.bucket = np.zeros(len(self.row), dtype=np.int64)
+		else:
+			self.bucket = bucket(self.lengths("src"), self.lengths("kb_nodes"))
+
+	def lengths(self, column):
+		"""Length of column in each record to read"""
+		lengths = np.concatenate([np.diff(getattr(c, column + "_offsets")) for c in self.columns])
+		starts = np.cumsum([0] + [len(c) for c in self.columns])
+		return lengths[starts[self.file] + self.row]
+
+	def __len__(self):
+		return len(self.row)
+
+	def batch(self, indices, src_pad, kb_nodes_pad, pad_to=(None, None)):
+		"""pad_to is the (src, kb_nodes) length to pad to, otherwise the longest in 
+		the batch. src longer than that is cut short."""
+		rows = [(self.columns[self.file[i]], self.row[i]) for i in indices]
+
+		src = [c.src[c.src_offsets[r]:c.src_offsets[r+1]][:pad_to[0]] for c, r in rows]
+		kb_nodes = [c.kb_nodes[c.kb_nodes_offsets[r]:c.kb_nodes_offsets[r+1]] for c, r in rows]
+
+		src_len = np.array([len(i) for i in src], dtype=np.int64)
+		kb_nodes_len = np.array([len(i) for i in kb_nodes], dtype=np.int64)
+		label = np.array([c.label[r] for c, r in rows], dtype=np.int64)
+		type_id = np.array([c.type_id[r] for c, r in rows], dtype=np.int64)
+
+		src_width = pad_to[0] if pad_to[0] is not None else max(src_len, default=0)
+		kb_nodes_width = pad_to[1] if pad_to[1] is not None else max(kb_nodes_len, default=0)
+
+		src_batch = np.full([len(rows), src_width], src_pad, dtype=np.int64)
+		kb_nodes_batch = np.full([len(rows), kb_nodes_width, self.kb_node_width], kb_nodes_pad, dtype=np.int64)
+
+		for n, (s, k) in enumerate(zip(src, kb_nodes)):
+			src_batch[n, :len(s)] = s
+			kb_nodes_batch[n, :len(k)] = k
+
+		return {
+			"src": 				src_batch,
+			"src_len": 			src_len,
+			"kb_nodes": 		kb_nodes_batch,
+			"kb_nodes_len": 	kb_nodes_len,
+			"label": 			label,
+			"type_id": 			type_id,
+		}, label
+
+	def batches(self, batch_size, src_pad, kb_nodes_pad, shuffle=True, repeat=True, drop_remainder=False, pad_to=(None, None)):
+		while True:
+			order = np.random.permutation(len(self)) if shuffle else np.arange(len(self))
+
+			# Split each bucket into batches, then shuffle the batches of every bucket together
+			batches = []
+			for b in np.unique(self.bucket):
+				in_bucket = order[self.bucket[order] == b]
+				end = len(in_bucket) - (len(in_bucket) % batch_size if drop_remainder else 0)
+				batches.extend(in_bucket[i:i+batch_size] for i in range(0, end, batch_size))
+
+			if shuffle:
+				batches = [batches[i] for i in np.random.permutation(len(batches))]
+
+			for i in batches:
+				yield self.batch(i, src_pad, kb_nodes_pad, pad_to)
+
+			if not repeat or len(batches) == 0:
+				return
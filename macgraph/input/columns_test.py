@@ -0,0 +1,93 @@
+import unittest
+import tempfile
+import os.path
+
+import numpy as np
+
+from .columns import *
+
+class TestColumns(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "train_input.columns")
+
+        writer = ColumnWriter(self.path, 2)
+        writer.append([5, 6, 7], [1, 2, 3, 4], 10, 0)
+        writer.append([8], [], 11, 1)
+        writer.append([9, 9], [5, 6], 12, 0)
+        writer.close()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_round_trip(self):
+        columns = Columns(self.path)
+
+        self.assertEqual(len(columns), 3)
+        self.assertEqual(list(columns.type_id), [0, 1, 0])
+        self.assertEqual(list(columns.src_offsets), [0, 3, 4, 6])
+        self.assertEqual(list(columns.kb_nodes_offsets), [0, 2, 2, 3])
+        self.assertEqual(columns.kb_nodes.shape, (3, 2))
+
+    def test_write_column_record(self):
+        path = os.path.join(self.dir.name, "eval_input.columns")
+
+        writer = ColumnWriter(path, 2)
+        writer.write(ColumnRecord(np.array([3, 4], np.int32), np.array([7, 8], np.int32), 5, 2))
+        writer.close()
+
+        columns = Columns(path)
+        self.assertEqual(list(columns.src), [3, 4])
+        np.testing.assert_array_equal(columns.kb_nodes, [[7, 8]])
+        self.assertEqual(list(columns.label), [5])
+
+    def test_empty(self):
+        path = os.path.join(self.dir.name, "predict_input.columns")
+        ColumnWriter(path, 2).close()
+
+        columns = Columns(path)
+        self.assertEqual(len(columns), 0)
+        self.assertEqual(columns.kb_nodes.shape, (0, 2))
+
+    def test_batch_padding(self):
+        reader = ColumnReader([self.path], 2)
+        features, label = reader.batch([0, 1], src_pad=1, kb_nodes_pad=0)
+
+        np.testing.assert_array_equal(features["src"], [[5, 6, 7], [8, 1, 1]])
+        np.testing.assert_array_equal(features["src_len"], [3, 1])
+        np.testing.assert_array_equal(features["kb_nodes"], [[[1, 2], [3, 4]], [[0, 0], [0, 0]]])
+        np.testing.assert_array_equal(features["kb_nodes_len"], [2, 0])
+        np.testing.assert_array_equal(label, [10, 11])
+        np.testing.assert_array_equal(features["type_id"], [0, 1])
+
+    def test_batch_pad_to(self):
+        reader = ColumnReader([self.path], 2)
+        features, label = reader.batch([0, 2], src_pad=1, kb_nodes_pad=0, pad_to=(2, 3))
+
+        np.testing.assert_array_equal(features["src"], [[5, 6], [9, 9]])
+        np.testing.assert_array_equal(features["src_len"], [2, 2])
+        self.assertEqual(features["kb_nodes"].shape, (2, 3, 2))
+
+    def test_type_ids_and_limit(self):
+        # The limit counts matching records
+        reader = ColumnReader([self.path, self.path], 2, type_ids=[0], limit=3)
+        self.assertEqual(len(reader), 3)
+
+        batches = list(reader.batches(2, 1, 0, shuffle=False, repeat=False))
+        self.assertEqual([len(l) for _, l in batches], [2, 1])
+        self.assertEqual(sorted(l for _, b in batches for l in b), [10, 10, 12])
+
+        batches = list(reader.batches(2, 1, 0, shuffle=False, repeat=False, drop_remainder=True))
+        self.assertEqual([len(l) for _, l in batches], [2])
+
+    def test_bucketing(self):
+        reader = ColumnReader([self.path], 2, bucket=lambda src_len, kb_nodes_len: (src_len >= 2).astype(np.int64))
+        np.testing.assert_array_equal(reader.bucket, [1, 0, 1])
+
+        batches = list(reader.batches(2, 1, 0, repeat=False))
+        self.assertEqual(sorted(sorted(l.tolist()) for _, l in batches), [[10, 12], [11]])
+
+
+if __name__ == '__main__':
+    unittest.main()
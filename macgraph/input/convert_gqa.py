@@ -0,0 +1,47 @@
+
+import json
+import os.path
+import tensorflow as tf
+from tqdm import tqdm
+
+from .args import *
+from .util import *
+
+import logging
+logger = logging.getLogger(__name__)
+
+# --------------------------------------------------------------------------
+# One-off conversion of a GQA YAML file into JSON-lines, which read_gqa
+# can stream much faster (one doc per line)
+# --------------------------------------------------------------------------
+
+def convert(in_path, out_path):
+	count = 0
+
+	with tf.gfile.GFile(out_path, "w") as out_file:
+		for doc in tqdm(read_gqa_docs(in_path)):
+			if doc is not None:
+				out_file.write(json.dumps(doc, default=str) + "\n")
+				count += 1
+
+	return count
+
+
+def extend_args(parser):
+	parser.add_argument('--output-path', type=str, default=None, help="Where to write the JSON-lines file (defaults to gqa-path with a .jsonl extension)")
+
+
+if __name__ == "__main__":
+
+	args = get_args(extend_args)
+
+	logging.basicConfig()
+	logger.setLevel(args["log_level"])
+
+	out_path = args["output_path"]
+	if out_path is None:
+		out_path = os.path.splitext(args["gqa_path"])[0] + ".jsonl"
+
+	count = convert(args["gqa_path"], out_path)
+	logger.info(f"Wrote {count} docs to {out_path}")
+
@@ -7,7 +7,8 @@ NODE_PROPS = ["name", "cleanliness", "music", "architecture", "size", "has_rail"
 EDGE_PROPS = ["line_name"]
 
 
-def gqa_to_tokens(args, gqa):
+def gqa_to_tokens(args, gqa, question=None):
+	"""question, if given, is the already pretokenized english question"""
 
 	tokens = list()
 
@@ -19,7 +20,10 @@ def gqa_to_tokens(args, gqa):
 		for key in NODE_PROPS:
 			tokens.append(pretokenize_json(node[key]))
 
-	tokens += pretokenize_english(gqa["question"]["english"]).split(' ')
+	if question is None:
+		question = pretokenize_english(gqa["question"]["english"])
+
+	tokens += question.split(' ')
 
 	try:
 		tokens.append(pretokenize_json(gqa["answer"]))
@@ -29,28 +33,31 @@ def gqa_to_tokens(args, gqa):
 	return tokens
 
 
-def graph_to_table(args, vocab, graph):
+def pack_table(args, ids):
+	"""Truncate or pad (with UNK_ID) each row of an [n_nodes, n_props] id array to kb_node_width"""
+	width = args["kb_node_width"]
+	table = np.full([ids.shape[0], width], UNK_ID, dtype=np.int64)
+	n = min(width, ids.shape[1])
+	table[:, :n] = ids[:, :n]
+	return table
+
 
-	def node_to_vec(node, props=NODE_PROPS):
-		return np.array([
-			vocab.lookup(pretokenize_json(node[key])) for key in props
-		])
+def props_to_table(vocab, items, props, width):
+	"""Look up props of every item (e.g. NODE_PROPS of each node) into a [len(items), width] 
+	id table, one column at a time. Props past width are dropped, missing columns are UNK_ID"""
 
+	table = np.full([len(items), width], UNK_ID, dtype=np.int64)
 
-	def pack(row, width):
-		if len(row) > width:
-			r = row[0:width]
-		elif len(row) < width:
-			r = np.pad(row, (0, width - len(row)), 'constant', constant_values=UNK_ID)
-		else:
-			r = row
+	for col, key in enumerate(props[:width]):
+		table[:, col] = vocab.lookup_batch([pretokenize_json(i[key]) for i in items])
 
-		assert len(r) == width, "Extraction functions didn't create the right length of knowledge table data"
-		return r
+	return table
 
-	node_lookup = {i["id"]: i for i in graph["nodes"]}
-	nodes = [pack(node_to_vec(i), args["kb_node_width"]) for i in graph["nodes"]]
+
+def graph_to_table(args, vocab, graph):
+	nodes = props_to_table(vocab, graph["nodes"], NODE_PROPS, args["kb_node_width"])
 	assert len(graph["nodes"]) <= args["kb_node_max_len"]
 
-	return np.array(nodes)
+	return nodes
+
 
@@ -5,9 +5,30 @@ import tensorflow as tf
 import logging
 logger = logging.getLogger(__name__)
 
-from .text_util import EOS_ID, UNK_ID
+import os.path
+import json
+import hashlib
+import uuid
+
+from .text_util import EOS_ID, UNK_ID, Vocab
 from .graph_util import *
 from .util import *
+from .columns import ColumnReader
+from .manifest import Manifest, record_count
+from .type_table import TypeTable, UNKNOWN_TYPE_ID
+
+# Most shards to read from at once
+MAX_PARALLEL_READS = 8
+
+# Size to assume for a serialized record when the manifest can't say
+DEFAULT_RECORD_BYTES = 2048
+
+# Fewest records to shuffle between, however big they are. The file order 
+# shuffle does nothing for a single shard, so this stage has to mix enough.
+MIN_SHUFFLE_RECORDS = 16384
+
+# Batches in an eval round (train.py's EvalSpec)
+EVAL_STEPS = 100
 
 def parse_single_example(i):
 	return tf.parse_single_example(
@@ -41,81 +62,370 @@ def reshape_example(args, i):
 
 
 
+def matching_files(args, mode):
+	"""The shards to read for mode, and whether their records need filtering by type string prefix"""
+	files, needs_filter = prefix_input_files(args, mode)
+
+	if len(files) == 0:
+		pattern = args[f"{mode}_columns_pattern" if args["record_format"] == "columns" else f"{mode}_input_pattern"]
+		raise FileNotFoundError(f"No {args['record_format']} files found matching {pattern} with type string prefix {args['type_string_prefix']}")
+
+	return files, needs_filter
+
+
+def read_dataset(args, files):
+	"""Serialized records from every shard in files, read in parallel. Each file
+	is read with its own compression, so a directory can mix them (e.g. the 
+	generations of an incremental build)"""
+
+	compression = [dataset_compression_type(record_compression(i)) for i in files]
+
+	# A new file order every epoch, the first stage of the shuffle
+	d = tf.data.Dataset.from_tensor_slices((files, compression))
+	d = d.shuffle(len(files))
+
+	d = d.apply(tf.contrib.data.parallel_interleave(
+		lambda f, c: tf.data.TFRecordDataset(f, compression_type=c),
+		cycle_length=min(len(files), MAX_PARALLEL_READS)))
+
+	return d
+
+
+def shuffle_buffer_size(args, mode):
+	"""How many serialized records fit in --shuffle-buffer-mb, at least MIN_SHUFFLE_RECORDS"""
+	manifest = Manifest.load(args)
+	record_bytes = manifest and manifest.average_record_bytes(mode)
+
+	if not record_bytes:
+		logger.debug(f"No record sizes for {mode} in the manifest, assuming {DEFAULT_RECORD_BYTES} bytes")
+		record_bytes = DEFAULT_RECORD_BYTES
+
+	size = int(args["shuffle_buffer_mb"] * 2**20 / record_bytes)
+	return max(size, MIN_SHUFFLE_RECORDS, args["batch_size"])
+
+
+# --------------------------------------------------------------------------
+# Length bucketing, so a batch's padding is set by similar sized records
+# --------------------------------------------------------------------------
+
+def length_bucket(args, src_len, kb_nodes_len):
+	"""Which bucket records are batched in, works on tensors or NumPy arrays"""
+	kb_buckets = args["kb_node_max_len"] // args["bucket_kb_nodes_width"] + 1
+	return (src_len // args["bucket_src_width"]) * kb_buckets + kb_nodes_len // args["bucket_kb_nodes_width"]
+
+def bucket_batch(args, d, drop_remainder):
+	"""Batch parsed records with others in the same length bucket, padding like 
+	parse_example_batch. The bucket key comes from the lengths already parsed."""
+
+	def padding_value(k, dtype):
+		if dtype == tf.string:
+			return tf.constant("", dtype)
+		return tf.constant({"src": EOS_ID, "kb_nodes": UNK_ID}.get(k, 0), dtype)
+
+	padding_values = {k: padding_value(k, v) for k, v in d.output_types.items()}
+
+	return d.apply(tf.contrib.data.group_by_window(
+		key_func=lambda i: length_bucket(args, i["src_len"], i["kb_nodes_len"]),
+		reduce_func=lambda key, window: window.padded_batch(args["batch_size"], 
+			padded_shapes=window.output_shapes, 
+			padding_values=padding_values, 
+			drop_remainder=drop_remainder),
+		window_size=args["batch_size"]))
+
+def padding_efficiency(features):
+	"""For src and kb_nodes, the fraction of the padded batch that's real data, 
+	and the size of the padded batch"""
+	def efficiency(lengths, padded):
+		size = tf.to_float(tf.shape(padded)[0] * tf.shape(padded)[1])
+		return tf.to_float(tf.reduce_sum(lengths)) / tf.maximum(size, 1.0), size
+
+	return {
+		"src": 		efficiency(features["src_len"], features["src"]),
+		"kb_nodes": efficiency(features["kb_nodes_len"], features["kb_nodes"]),
+	}
+
+
+def add_dynamic_dimensions(d):
+	"""Add dynamic dimensions for convenience (e.g. to do shape assertions)"""
+	return d.map(lambda features, labels: ({
+		**features, 
+		"d_batch_size": tf.shape(features["src"])[0], 
+		"d_src_len":    tf.shape(features["src"])[1],
+	}, labels))
+
+
+def columns_input_fn(args, mode, repeat=True):
+	"""Batches sliced straight out of the memory mapped columns, padded the 
+	same way as input_fn's"""
+
+	# Filtering the type ids is cheap, so it's done whether or not the files are partitioned
+	files, _ = matching_files(args, mode)
+
+	bucket = (lambda *lens: length_bucket(args, *lens)) if args["bucket_by_length"] else None
+	reader = ColumnReader(files, args["kb_node_width"], matching_type_ids(args), args["limit"], bucket)
+
+	if args["static_shapes"]:
+		pad_to = (args["max_seq_len"], args["kb_node_max_len"])
+		batch_size = args["batch_size"]
+	else:
+		pad_to = (None, None)
+		batch_size = None
+
+	def generator():
+		yield from reader.batches(
+			args["batch_size"], EOS_ID, UNK_ID, 
+			repeat=repeat, 
+			drop_remainder=(mode == "predict") or args["static_shapes"],
+			pad_to=pad_to)
+
+	d = tf.data.Dataset.from_generator(generator,
+		output_types=(
+			{
+				"src": 				tf.int64,
+				"src_len": 			tf.int64,
+				"kb_nodes": 		tf.int64,
+				"kb_nodes_len": 	tf.int64,
+				"label": 			tf.int64,
+				"type_id": 			tf.int64,
+			}, 
+			tf.int64,
+		),
+		output_shapes=(
+			{
+				"src": 				tf.TensorShape([batch_size, pad_to[0]]),
+				"src_len": 			tf.TensorShape([batch_size]),
+				"kb_nodes": 		tf.TensorShape([batch_size, pad_to[1], args["kb_node_width"]]),
+				"kb_nodes_len": 	tf.TensorShape([batch_size]),
+				"label": 			tf.TensorShape([batch_size]),
+				"type_id": 			tf.TensorShape([batch_size]),
+			},
+			tf.TensorShape([batch_size]),
+		))
+
+	d = add_dynamic_dimensions(d)
+	d = d.prefetch(args["input_prefetch"])
+
+	return d
+
+
+def example_features(with_type_string=False):
+	"""with_type_string also parses the type strings, for data without type ids"""
+	features = {
+		'src': 				parse_feature_int_array(EOS_ID),
+		'src_len': 			parse_feature_int(),
+		
+		'kb_nodes': 		parse_feature_int_array(UNK_ID),
+		'kb_nodes_len': 	parse_feature_int(),
+		
+		'label': 			parse_feature_int(),
+		'type_id':			parse_feature_int(UNKNOWN_TYPE_ID),
+	}
+
+	if with_type_string:
+		features['type_string'] = parse_type_string_feature()
+
+	return features
+
+def parse_example(args, i, with_type_string=False):
+	"""Parse one serialized record, for batching after parsing (see bucket_batch)"""
+	r = tf.parse_single_example(i, features=example_features(with_type_string))
+	r["kb_nodes"] = tf.reshape(r["kb_nodes"], [-1, args["kb_node_width"]])
+	return r
+
+def parse_example_batch(args, i, with_type_string=False):
+	"""Parse a batch of serialized records. The sequence features are padded 
+	to the longest in the batch with their defaults, like padded_batch would."""
+
+	r = tf.parse_example(i, features=example_features(with_type_string))
+
+	# Every record's kb_nodes is a whole number of rows, so the padded batch is too
+	r["kb_nodes"] = tf.reshape(r["kb_nodes"], [tf.shape(i)[0], -1, args["kb_node_width"]])
+
+	return r, r["label"]
+
+
+def pad_to_static(args, features, labels):
+	"""Pad a batch out to --max-seq-len and --kb-node-max-len so that every batch
+	has the same, fully known shape. Longer questions are cut short."""
+
+	def pad(t, length, value):
+		t = t[:, :length]
+		padding = [[0, 0], [0, length - tf.shape(t)[1]]] + [[0, 0]] * (len(t.shape) - 2)
+		return tf.pad(t, padding, constant_values=value)
+
+	batch_size = args["batch_size"]
+
+	features = {
+		**features,
+		"src": 		pad(features["src"], args["max_seq_len"], EOS_ID),
+		"src_len": 	tf.minimum(features["src_len"], args["max_seq_len"]),
+		"kb_nodes": pad(features["kb_nodes"], args["kb_node_max_len"], UNK_ID),
+	}
+
+	features["src"].set_shape([batch_size, args["max_seq_len"]])
+	features["kb_nodes"].set_shape([batch_size, args["kb_node_max_len"], args["kb_node_width"]])
+
+	for k in ["src_len", "kb_nodes_len", "label", "type_id", "type_string"]:
+		if k in features:
+			features[k].set_shape([batch_size])
+
+	labels.set_shape([batch_size])
+
+	return features, labels
+
+
+def parse_type_id(i):
+	return tf.parse_single_example(i, features={'type_id': parse_feature_int(UNKNOWN_TYPE_ID)})["type_id"]
+
+def parse_type_string_feature():
+	"""A record's one type string as a scalar, unlike parse_feature_string"""
+	return tf.FixedLenFeature([], tf.string, default_value="")
+
+def matches_type_string_prefix(i, prefix):
+	"""For data without type ids, compare the type string itself"""
+	type_string = tf.parse_single_example(i, features={'type_string': parse_type_string_feature()})["type_string"]
+	return tf.equal(tf.substr(type_string, 0, len(prefix.encode("utf-8"))), prefix)
+
+def matching_type_ids(args):
+	"""Ids of the types with args' type string prefix, None for every type"""
+	if args["type_string_prefix"] is None:
+		return None
+
+	return TypeTable.load(args).matching(args["type_string_prefix"])
+
+
+# --------------------------------------------------------------------------
+# Caching parsed batches
+# --------------------------------------------------------------------------
+
+# Args that change what the cached batches hold
+CACHE_KEY_ARGS = [
+	"vocab_size", "kb_node_width", "batch_size", "limit", "type_string_prefix", 
+	"bucket_by_length", "bucket_src_width", "bucket_kb_nodes_width", "kb_node_max_len",
+	"static_shapes", "max_seq_len",
+]
+
+def cache_key(args, mode, files):
+	"""Hash of everything the parsed batches depend on, so a stale cache is never read"""
+	def describe(path):
+		stat = tf.gfile.Stat(path)
+		return [path, stat.length, stat.mtime_nsec]
+
+	key = {
+		"mode": mode,
+		"files": [describe(i) for i in files],
+		"vocab": Vocab.load(args).fingerprint(),
+		"args": {k: args[k] for k in CACHE_KEY_ARGS},
+	}
+
+	return hashlib.sha1(json.dumps(key, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+def cache_batches(args, mode, files, d):
+	"""Cache parsed batches on local disk. The Estimator builds a new eval dataset 
+	every round, so even eval's batches only outlive the round on disk (where the 
+	small eval cache stays in the page cache).
+
+	tf.data only writes a cache's index once its first pass ends, and refuses a 
+	prefix with a lockfile left on it. So a finished cache (one with an index) is 
+	reused, and otherwise each dataset writes to its own prefix: an interrupted 
+	run or a second process on the host can't block or corrupt this one, and 
+	their partial files are never read."""
+	tf.gfile.MakeDirs(args["cache_dir"])
+	prefix = os.path.join(args["cache_dir"], f"{mode}-{cache_key(args, mode, files)}")
+
+	finished = sorted(tf.gfile.Glob(prefix + ".*.index"))
+
+	if len(finished) > 0:
+		path = finished[0][:-len(".index")]
+		logger.info(f"Reading cached {mode} batches from {path}")
+	else:
+		path = f"{prefix}.{os.getpid()}-{uuid.uuid4().hex[:8]}"
+		logger.info(f"Caching {mode} batches in {path}")
+
+	return d.cache(path)
+
+def eval_round_reads_all(args):
+	"""Whether an eval round of EVAL_STEPS batches reads every eval batch. A cache 
+	is only finished once its input ends, otherwise every round would start another."""
+	records = min_none(record_count(args, "eval"), args["limit"])
+	batches = -(-records // args["batch_size"])
+
+	# Each length bucket can end with a partial batch
+	if args["bucket_by_length"]:
+		batches += length_bucket(args, args["max_seq_len"], args["kb_node_max_len"]) + 1
+
+	return batches <= EVAL_STEPS
+
+
+
 def input_fn(args, mode, question=None, repeat=True):
 
+	if args["record_format"] == "columns":
+		return columns_input_fn(args, mode, repeat)
+
 	# --------------------------------------------------------------------------
 	# Read TFRecords
 	# --------------------------------------------------------------------------
 
-	d = tf.data.TFRecordDataset([args[f"{mode}_input_path"]])
-	d = d.map(parse_single_example)
+	# Files partitioned by type that don't match the prefix are skipped entirely
+	files, needs_filter = matching_files(args, mode)
+	d = read_dataset(args, files)
 
-	# --------------------------------------------------------------------------
-	# Layout input data
-	# --------------------------------------------------------------------------
+	# Data built before type ids (e.g. the download) only has type strings
+	types = TypeTable.load_if_exists(args)
 
-	d = d.map(lambda i: reshape_example(args,i))
-	
+	# Only the type id needs parsing to filter
+	if needs_filter and types is None:
+		d = d.filter(lambda i: matches_type_string_prefix(i, args["type_string_prefix"]))
+
+	elif needs_filter:
+		type_ids = tf.constant(types.matching(args["type_string_prefix"]), tf.int64)
+		d = d.filter(lambda i: 
+			tf.reduce_any(tf.equal(parse_type_id(i), type_ids)))
 
+	# After the filter, so the limit counts matching records whether or not 
+	# the files are partitioned by type
 	if args["limit"] is not None:
 		d = d.take(args["limit"])
 
-	if args["type_string_prefix"] is not None:
-		d = d.filter(lambda features, labels: 
-			tf_startswith(features["type_string"], args["type_string_prefix"]))
+	# Second stage of the shuffle, records from the interleaved files
+	d = d.shuffle(shuffle_buffer_size(args, mode))
 
-	d = d.shuffle(args["batch_size"]*1000)
+	# --------------------------------------------------------------------------
+	# Batch, then parse and layout a whole batch at once. Bucketing needs each 
+	# record's lengths first, so there every record is parsed (once) then batched.
+	# --------------------------------------------------------------------------
 
-	zero_64 = tf.cast(0, tf.int64) 
-	unk_64  = tf.cast(UNK_ID, tf.int64)
+	# Static shapes need every batch full
+	drop_remainder = (mode == "predict") or args["static_shapes"]
 
-	d = d.padded_batch(
-		args["batch_size"],
-		# The first three entries are the source and target line rows;
-		# these have unknown-length vectors.	The last two entries are
-		# the source and target row sizes; these are scalars.
-		padded_shapes=(
-			{
-				"src": 				tf.TensorShape([None]),
-				"src_len": 			tf.TensorShape([]), 
-
-				"kb_nodes": 		tf.TensorShape([None, args["kb_node_width"]]),
-				"kb_nodes_len": 	tf.TensorShape([]), 
-				
-				"label": 			tf.TensorShape([]), 
-				"type_string": 		tf.TensorShape([None]),
-			},
-			tf.TensorShape([]),	# label
-		),
-			
-		# Pad the source and target sequences with eos tokens.
-		# (Though notice we don't generally need to do this since
-		# later on we will be masking out calculations past the true sequence.
-		padding_values=(
-			{
-				"src": 				tf.cast(EOS_ID, tf.int64), 
-				"src_len": 			zero_64, # unused
-
-				"kb_nodes": 		unk_64, 
-				"kb_nodes_len": 	zero_64, # unused
-				
-				"label":			zero_64,
-				"type_string": 		tf.cast("", tf.string),
-			},
-			zero_64 # label (unused)
-		),
-		drop_remainder=(mode == "predict")
-	)
+	if args["bucket_by_length"]:
+		d = d.map(lambda i: parse_example(args, i, types is None), num_parallel_calls=args["input_threads"])
+		d = bucket_batch(args, d, drop_remainder)
+		d = d.map(lambda features: (features, features["label"]))
+	else:
+		d = d.batch(args["batch_size"], drop_remainder=drop_remainder)
+		d = d.map(lambda i: parse_example_batch(args, i, types is None), num_parallel_calls=args["input_threads"])
 
-	# Add dynamic dimensions for convenience (e.g. to do shape assertions)
-	d = d.map(lambda features, labels: ({
-		**features, 
-		"d_batch_size": tf.shape(features["src"])[0], 
-		"d_src_len":    tf.shape(features["src"])[1],
-	}, labels))
+	if args["static_shapes"]:
+		d = d.map(lambda features, labels: pad_to_static(args, features, labels), num_parallel_calls=args["input_threads"])
+
+	# Later epochs reuse the batches (the records in each stay the same,
+	# the order of the batches is still shuffled)
+	if args["cache_input"] and mode == "eval" and not eval_round_reads_all(args):
+		logger.info(f"Not caching eval batches, an eval round of {EVAL_STEPS} steps doesn't read them all")
+
+	elif args["cache_input"] and mode in ["train", "eval"]:
+		d = cache_batches(args, mode, files, d)
+		d = d.shuffle(args["cache_shuffle_batches"])
+	
+	d = add_dynamic_dimensions(d)
 
 	if repeat:
 		d = d.repeat()
+
+	# Prepare the next batches while the current one trains
+	d = d.prefetch(args["input_prefetch"])
 	
 	return d
 
@@ -0,0 +1,72 @@
+import unittest
+import tempfile
+import os.path
+
+import tensorflow as tf
+
+import numpy as np
+
+from .input import parse_example_batch
+from .text_util import EOS_ID, UNK_ID
+
+def int64_feature(value):
+    return tf.train.Feature(int64_list=tf.train.Int64List(value=value))
+
+def example(src, kb_nodes, label, type_id):
+    feature = {
+        "src":          int64_feature(src),
+        "src_len":      int64_feature([len(src)]),
+        "kb_nodes":     int64_feature(np.array(kb_nodes, dtype=np.int64).flatten()),
+        "kb_nodes_len": int64_feature([len(kb_nodes)]),
+        "label":        int64_feature([label]),
+        "type_id":      int64_feature([type_id]),
+    }
+    return tf.train.Example(features=tf.train.Features(feature=feature)).SerializeToString()
+
+class TestParseExampleBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "train_input.tfrecords")
+
+        with tf.python_io.TFRecordWriter(self.path) as writer:
+            writer.write(example([5, 6, 7], [[8, 9], [10, 11]], 4, 0))
+            writer.write(example([5], [[12, 13]], 5, 1))
+            writer.write(example([6, 7], [], 6, 0))
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_round_trip(self):
+        args = {"kb_node_width": 2}
+
+        with tf.Graph().as_default():
+            d = tf.data.TFRecordDataset(self.path).batch(3)
+            d = d.map(lambda i: parse_example_batch(args, i))
+            features, labels = d.make_one_shot_iterator().get_next()
+
+            self.assertEqual(features["kb_nodes"].shape.as_list()[-1], 2)
+
+            with tf.Session() as session:
+                features, labels = session.run([features, labels])
+
+        # Padded to the longest in the batch, src with EOS and kb_nodes with UNK
+        np.testing.assert_array_equal(features["src"], [
+            [5, 6, 7],
+            [5, EOS_ID, EOS_ID],
+            [6, 7, EOS_ID],
+        ])
+        np.testing.assert_array_equal(features["kb_nodes"], [
+            [[8, 9], [10, 11]],
+            [[12, 13], [UNK_ID, UNK_ID]],
+            [[UNK_ID, UNK_ID], [UNK_ID, UNK_ID]],
+        ])
+
+        np.testing.assert_array_equal(features["src_len"], [3, 1, 2])
+        np.testing.assert_array_equal(features["kb_nodes_len"], [2, 1, 0])
+        np.testing.assert_array_equal(features["type_id"], [0, 1, 0])
+        np.testing.assert_array_equal(labels, [4, 5, 6])
+
+
+if __name__ == '__main__':
+    unittest.main()
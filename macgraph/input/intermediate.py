@@ -0,0 +1,90 @@
+
+import numpy as np
+import pickle
+import tempfile
+
+from .text_util import pretokenize_english, pretokenize_json
+from .graph_util import NODE_PROPS
+
+# --------------------------------------------------------------------------
+# A compact, pre-tokenized form of GQA docs.
+#
+# This lets build count vocab tokens and generate records from one parse
+# of the source file: the first pass interns every string to a temporary
+# id and spills the docs to disk, then once the vocab is fixed the spill is
+# replayed into records.
+# --------------------------------------------------------------------------
+
+class Interner(object):
+	"""Assigns each distinct string a temporary id"""
+
+	def __init__(self):
+		self.tokens = []
+		self.index = {}
+
+	def __call__(self, token):
+		try:
+			return self.index[token]
+		except KeyError:
+			self.index[token] = len(self.tokens)
+			self.tokens.append(token)
+			return self.index[token]
+
+	def __len__(self):
+		return len(self.tokens)
+
+
+def doc_to_intermediate(interner, doc, question=None):
+	"""Returns (question, answer, nodes) as interned ids. 
+
+	The question is interned whole (post pretokenization) since unknown word 
+	expansion depends on the final vocab. Pass question if it's already been 
+	pretokenized. The answer is None if it's an unsupported type."""
+
+	if question is None:
+		question = pretokenize_english(doc["question"]["english"])
+
+	question = interner(question)
+
+	try:
+		answer = interner(pretokenize_json(doc["answer"]))
+	except ValueError:
+		answer = None
+
+	nodes = np.array([
+		[interner(pretokenize_json(node[key])) for key in NODE_PROPS]
+		for node in doc["graph"]["nodes"]
+	], dtype=np.int32).reshape([-1, len(NODE_PROPS)])
+
+	return question, answer, nodes
+
+
+class Spill(object):
+	"""Append-only temporary file of pickled items that can be replayed in order"""
+
+	def __init__(self):
+		self.file = None
+		self.count = 0
+
+	def __enter__(self):
+		self.file = tempfile.TemporaryFile()
+		return self
+
+	def write(self, item):
+		pickle.dump(item, self.file, pickle.HIGHEST_PROTOCOL)
+		self.count += 1
+
+	def __iter__(self):
+		self.file.flush()
+		self.file.seek(0)
+
+		for i in range(self.count):
+			yield pickle.load(self.file)
+
+	def __len__(self):
+		return self.count
+
+	def __exit__(self, *vargs):
+		self.file.close()
+		self.file = None
+
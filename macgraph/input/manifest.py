@@ -0,0 +1,166 @@
+
+import yaml
+import json
+import hashlib
+import tensorflow as tf
+from collections import Counter
+
+import logging
+logger = logging.getLogger(__name__)
+
+from .util import count_records
+
+# --------------------------------------------------------------------------
+# The manifest is a sidecar file describing a build, kept next to its TFRecords.
+# 
+# It has the vocab fingerprint, the build's settings and counters, and for each TFRecord 
+# file its mode, shard, record count, size and answer class / question type 
+# counts. Readers use it to know the dataset size without scanning it.
+# --------------------------------------------------------------------------
+
+def nest_counts(counts:Counter):
+	"""{(answer, type_string): n} as {answer: {type_string: n}}, since YAML keys can't be tuples"""
+	r = {}
+	for (answer, type_string), v in counts.items():
+		d = r.setdefault(answer, {})
+		d[type_string] = d.get(type_string, 0) + v
+	return r
+
+def unnest_counts(nested) -> Counter:
+	return Counter({
+		(answer, type_string): v
+		for answer, types in nested.items()
+		for type_string, v in types.items()
+	})
+
+
+class Manifest(object):
+
+	def __init__(self, data):
+		self.data = data
+
+	@classmethod
+	def new(cls, vocab, settings):
+		"""settings are the build's args that its records and their placement depend
+		on, which an incremental build must share"""
+		return Manifest({
+			"vocab": vocab.fingerprint(),
+			"settings": settings,
+			"generation": 0,
+			"question_types": {},
+			"answer_classes": {},
+			"answer_classes_types": {},
+			"files": [],
+		})
+
+	@classmethod
+	def load(cls, args):
+		"""Returns None if there is no manifest"""
+		if not tf.gfile.Exists(args["manifest_path"]):
+			return None
+
+		with tf.gfile.GFile(args["manifest_path"]) as file:
+			return Manifest(yaml.safe_load(file))
+
+	@classmethod
+	def remove(cls, args):
+		if tf.gfile.Exists(args["manifest_path"]):
+			tf.gfile.Remove(args["manifest_path"])
+
+	def save(self, args):
+		with tf.gfile.GFile(args["manifest_path"], "w") as file:
+			yaml.safe_dump(self.data, file, default_flow_style=False)
+
+	def __getitem__(self, key):
+		return self.data[key]
+
+	def __setitem__(self, key, value):
+		self.data[key] = value
+
+	# --------------------------------------------------------------------------
+
+	def add_counts(self, question_types:Counter, answer_classes:Counter, answer_classes_types:Counter):
+		"""Add a build's counters to the running totals"""
+
+		def add(d, counter):
+			for k, v in counter.items():
+				d[k] = d.get(k, 0) + v
+
+		add(self.data["question_types"], question_types)
+		add(self.data["answer_classes"], answer_classes)
+
+		total = unnest_counts(self.data["answer_classes_types"]) + answer_classes_types
+		self.data["answer_classes_types"] = nest_counts(total)
+
+	def answer_classes_types(self):
+		return dict(unnest_counts(self.data["answer_classes_types"]))
+
+	def add_files(self, shards_written):
+		for i in shards_written:
+			self.data["files"].append({
+				**i, 
+				"answer_classes_types": nest_counts(i["answer_classes_types"]),
+			})
+
+	# --------------------------------------------------------------------------
+
+	def files(self, mode):
+		return [i for i in self.data.get("files", []) if i["mode"] == mode]
+
+	def record_count(self, mode):
+		return sum(i["records"] for i in self.files(mode))
+
+	def average_record_bytes(self, mode):
+		"""Mean size of mode's records, from its uncompressed TFRecords. None if 
+		there aren't any to go by"""
+		files = [
+			i for i in self.files(mode) 
+			if i.get("format", "tfrecord") == "tfrecord" and i["compression"] == "NONE"
+		]
+		records = sum(i["records"] for i in files)
+
+		if records == 0:
+			return None
+
+		return sum(i["bytes"] for i in files) / records
+
+	def mode_answer_classes_types(self, mode) -> Counter:
+		"""Records in mode per (answer, type_string)"""
+		return sum((unnest_counts(i["answer_classes_types"]) for i in self.files(mode)), Counter())
+
+
+def record_count(args, mode):
+	"""How many records mode has, from the manifest if there is one, otherwise by reading them all"""
+	manifest = Manifest.load(args)
+
+	if manifest is not None and manifest.files(mode):
+		return manifest.record_count(mode)
+
+	logger.info(f"No manifest at {args['manifest_path']}, counting {mode} records")
+	return count_records(args, mode)
+
+
+# --------------------------------------------------------------------------
+# Source doc hashes, so an incremental build can skip docs it has seen
+# --------------------------------------------------------------------------
+
+def doc_hash(doc):
+	return hashlib.blake2b(json.dumps(doc, sort_keys=True, default=str).encode("utf-8"), digest_size=16).hexdigest()
+
+def load_doc_hashes(args):
+	"""Returns None if the last build didn't record doc hashes"""
+	if not tf.gfile.Exists(args["doc_hashes_path"]):
+		return None
+
+	with tf.gfile.GFile(args["doc_hashes_path"]) as file:
+		return set(line.strip() for line in file)
+
+def remove_doc_hashes(args):
+	if tf.gfile.Exists(args["doc_hashes_path"]):
+		tf.gfile.Remove(args["doc_hashes_path"])
+
+def save_doc_hashes(args, hashes, append):
+	with tf.gfile.GFile(args["doc_hashes_path"], "a" if append else "w") as file:
+		for i in hashes:
+			file.write(i + "\n")
+
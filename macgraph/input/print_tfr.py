@@ -11,6 +11,7 @@ from .args import *
 from .util import *
 from .text_util import *
 from .input import *
+from .manifest import Manifest
 
 def eager_to_str(v):
 	return bytes_to_string(np.array(v))
@@ -30,8 +31,24 @@ if __name__ == "__main__":
 	types = set()
 	labels = set()
 
+	manifest = Manifest.load(args)
 
-	for i in tqdm(tf.python_io.tf_record_iterator(args["train_input_path"]), total=args["limit"]):
+	# The manifest already has the distribution, only read records if we need to
+	if manifest is not None and not args["print_records"] and args["limit"] is None:
+		for (label, type_string), v in manifest.mode_answer_classes_types("train").items():
+			count += v
+
+			if args["type_string_prefix"] is None or type_string.startswith(args["type_string_prefix"]):
+				dist[(label, type_string)] += v
+				types.add(type_string)
+				labels.add(label)
+
+		records = []
+	else:
+		records = read_records(args, "train")
+
+
+	for i in tqdm(records, total=args["limit"]):
 
 		if args["limit"] is not None and count > args["limit"]:
 			break
@@ -0,0 +1,140 @@
+
+import time
+import random
+import resource
+import numpy as np
+from collections import defaultdict
+from contextlib import contextmanager
+
+# --------------------------------------------------------------------------
+# Per-stage timing of the build pipeline
+# --------------------------------------------------------------------------
+
+# How many latency samples to keep per stage for the percentiles
+RESERVOIR_SIZE = 10000
+
+def rss_mb():
+	"""The current resident set size (Linux only). Unlike ru_maxrss this can go 
+	down, so the difference either side of a stage is that stage's own."""
+	with open("/proc/self/statm") as file:
+		return int(file.read().split()[1]) * resource.getpagesize() / 2**20
+
+
+class StageStats(object):
+
+	def __init__(self):
+		self.count = 0
+		self.total = 0.0
+		self.reservoir = []
+
+		# Only set by measure_rss
+		self.rss_delta_mb = None
+
+	def add(self, seconds):
+		self.count += 1
+		self.total += seconds
+
+		# Reservoir sampling keeps a uniform sample of latencies in bounded memory
+		if len(self.reservoir) < RESERVOIR_SIZE:
+			self.reservoir.append(seconds)
+		else:
+			i = random.randrange(self.count)
+			if i < RESERVOIR_SIZE:
+				self.reservoir[i] = seconds
+
+	def merge(self, other):
+		self.count += other.count
+		self.total += other.total
+
+		# Approximate, fine for percentiles of similar workers
+		self.reservoir += other.reservoir
+		if len(self.reservoir) > RESERVOIR_SIZE:
+			self.reservoir = random.sample(self.reservoir, RESERVOIR_SIZE)
+
+	def report(self):
+		p50, p99 = np.percentile(self.reservoir, [50, 99]) if self.count > 0 else (0, 0)
+		r = {
+			"docs": self.count,
+			"seconds": round(self.total, 3),
+			"docs_per_sec": round(self.count / self.total, 1) if self.total > 0 else None,
+			"p50_ms": round(p50 * 1000, 4),
+			"p99_ms": round(p99 * 1000, 4),
+		}
+
+		if self.rss_delta_mb is not None:
+			r["rss_delta_mb"] = round(self.rss_delta_mb, 1)
+
+		return r
+
+
+class StageProfiler(object):
+	"""Times named stages of the build, one sample per doc. 
+
+	Use as `with profiler("stage"):`, or wrap an iterator with profiler.iterate("stage", it)
+	to time each item it produces. When disabled it does nothing."""
+
+	def __init__(self, enabled=True):
+		self.enabled = enabled
+		self.stages = defaultdict(StageStats)
+
+	@contextmanager
+	def __call__(self, stage):
+		if not self.enabled:
+			yield
+			return
+
+		start = time.perf_counter()
+		try:
+			yield
+		finally:
+			self.record(stage, time.perf_counter() - start)
+
+	def record(self, stage, seconds):
+		self.stages[stage].add(seconds)
+
+	@contextmanager
+	def measure_rss(self, stage):
+		"""Record how much the resident set grows over the block. Only meaningful 
+		when the block runs just the one stage, e.g. in bench_build."""
+		if not self.enabled:
+			yield
+			return
+
+		start = rss_mb()
+		try:
+			yield
+		finally:
+			self.stages[stage].rss_delta_mb = rss_mb() - start
+
+	def iterate(self, stage, iterable):
+		if not self.enabled:
+			yield from iterable
+			return
+
+		it = iter(iterable)
+		while True:
+			start = time.perf_counter()
+			try:
+				i = next(it)
+			except StopIteration:
+				return
+			self.record(stage, time.perf_counter() - start)
+			yield i
+
+	def drain(self):
+		"""Return the stats so far and start afresh (e.g. to send them from a worker process)"""
+		stages = self.stages
+		self.stages = defaultdict(StageStats)
+		return stages
+
+	def merge(self, stages):
+		for k, v in stages.items():
+			self.stages[k].merge(v)
+
+	def report(self):
+		return {k: v.report() for k, v in self.stages.items()}
+
+
+# Shared do-nothing instance, the default wherever a profiler is optional
+NO_PROFILER = StageProfiler(enabled=False)
+
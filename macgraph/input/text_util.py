@@ -5,6 +5,9 @@ import numpy as np
 from typing import List, Set
 import re
 import string
+import itertools
+import hashlib
+from functools import lru_cache
 from tqdm import tqdm
 
 import logging
@@ -40,6 +43,22 @@ EOS_ID = SPECIAL_TOKENS.index(EOS)
 
 ENGLISH_PUNCTUATION = '!"#$%&()*+,-./:;=?@[\\]^_`{|}~'
 
+# Does pretokenize_english's newline removal, space marking and punctuation 
+# spacing in one pass over the string
+ENGLISH_TRANSLATION = str.maketrans({
+	"\n": None,
+	" ": f" {SPACE} ",
+	**{p: f" {p} " for p in ENGLISH_PUNCTUATION},
+})
+
+# Questions are generated from a small set of templates, so are frequently repeated
+ENGLISH_CACHE_SIZE = 2**16
+
+# Bump whenever the tokenizers split text differently. It's part of the vocab 
+# fingerprint, so records built with another tokenization are never mixed in.
+# Version 2: unknown words are expanded token by token
+TOKENIZER_VERSION = 2
+
 # --------------------------------------------------------------------------
 
 
@@ -60,14 +79,12 @@ def pretokenize_json(value):
 	raise ValueError("Unsupported json value type")
 
 
+@lru_cache(maxsize=ENGLISH_CACHE_SIZE)
 def pretokenize_english(text):
-	text = pretokenize_general(text)
-
-	for p in ENGLISH_PUNCTUATION:
-		text = text.replace(p, f" {p} ")
-
-	text = re.sub(r'\s*$', '', text)
-	return text
+	# Equivalent to pretokenize_general then spacing out each ENGLISH_PUNCTUATION character
+	text = text.replace("\n", "").rstrip()
+	text = text.translate(ENGLISH_TRANSLATION)
+	return text.rstrip()
 
 
 def detokenize_english(text):
@@ -79,6 +96,17 @@ def detokenize_english(text):
 	return text
 
 
+def pad_ids(ids, lengths, pad):
+	"""Lay out a flat array of ids as rows of the given lengths, padded with `pad`"""
+	lengths = np.array(lengths, dtype=np.int64)
+	width = lengths.max() if len(lengths) > 0 else 0
+
+	out = np.full([len(lengths), width], pad, dtype=np.int64)
+	out[np.arange(width) < np.expand_dims(lengths, -1)] = ids
+
+	return out, lengths
+
+
 def bytes_to_string(p):
 	if len(p) == 0:
 		return ""
@@ -99,8 +127,17 @@ class Vocab(object):
 	def __init__(self, table:List[str]):
 		self.table = table
 
+		# Reverse index so lookups don't need to scan the table
+		self.index = {}
+		for i, v in enumerate(table):
+			self.index.setdefault(v, i)
+
+		self.table_array = np.array(table, dtype=object)
+
+		self.pretokenized_english_to_ids = lru_cache(maxsize=ENGLISH_CACHE_SIZE)(self._pretokenized_english_to_ids)
+
 	def __contains__(self, value):
-		return value in self.table
+		return value in self.index
 
 	def __iter__(self):
 		return iter(self.table)
@@ -111,10 +148,7 @@ class Vocab(object):
 	# -------------------------------------------------------------------------- #
 
 	def lookup(self, value):
-		try:
-			return self.table.index(value)
-		except ValueError:
-			return UNK_ID
+		return self.index.get(value, UNK_ID)
 
 	def inverse_lookup(self, value):
 		try:
@@ -122,8 +156,42 @@ class Vocab(object):
 		except IndexError:
 			return UNK
 
+	# -------------------------------------------------------------------------- #
+	# Batch versions of the above
+	# -------------------------------------------------------------------------- #
+
+	def lookup_batch(self, values) -> np.ndarray:
+		"""Map an iterable of tokens to an int64 array of ids"""
+		return np.fromiter((self.index.get(i, UNK_ID) for i in values), dtype=np.int64)
+
+	def inverse_lookup_batch(self, ids) -> np.ndarray:
+		"""Map an array of ids (of any shape) to an array of tokens of the same shape.
+		Out of range ids become UNK."""
+		ids = np.asarray(ids, dtype=np.int64)
+		in_range = (ids >= 0) & (ids < len(self.table))
+		return self.table_array[np.where(in_range, ids, UNK_ID)]
+
+	def lines_to_ids(self, lines:List[List[str]], pad=EOS_ID):
+		"""Map many token lists to a [len(lines), longest line] int64 array padded 
+		with `pad`. Returns the array and the length of each line."""
+		lengths = [len(i) for i in lines]
+		return pad_ids(self.lookup_batch(itertools.chain.from_iterable(lines)), lengths, pad)
+
+	def tokenize_batch(self, lines:List[str], pad=EOS_ID):
+		"""Tokenize many english strings (e.g. questions) into a [len(lines), longest line]
+		int64 array padded with `pad`. Returns the array and the length of each line."""
+		ids = [self.english_to_ids(i) for i in lines]
+		lengths = [len(i) for i in ids]
+		return pad_ids(np.fromiter(itertools.chain.from_iterable(ids), dtype=np.int64), lengths, pad)
+
+	def ids_to_strings(self, ids):
+		"""Map an id matrix to one space separated string per row"""
+		return [' '.join(row) for row in self.inverse_lookup_batch(ids)]
+
+	# -------------------------------------------------------------------------- #
+
 	def ids_to_string(self, line, output_as_array=False):
-		d = [self.inverse_lookup(i) for i in line]
+		d = self.inverse_lookup_batch(line).tolist()
 		if output_as_array:
 			return d
 		else:
@@ -132,24 +200,36 @@ class Vocab(object):
 	def string_to_ids(self, line):
 		return [self.lookup(i) for i in line.split(' ')]
 
-	def expand_unknowns(self, line):
-		unknowns = set(line.split(' '))
-		unknowns -= set(self.table)
-		unknowns -= set([''])
+	def expand_unknown_tokens(self, tokens:List[str]):
+		"""Spell out tokens that are not in the vocab as character tokens.
 
-		for t in unknowns:
-			spaced = ''.join([f"<{c}> " for c in t])
-			line = line.replace(t, spaced)
+		Each spelt out token is followed by an empty token, as happened when this
+		was done by string replacement on the whole line. Unlike that replacement,
+		only whole tokens are spelt out, not an unknown word inside a known token 
+		(e.g. "Stat" inside "Station")."""
+		out = []
 
-		return line
+		for t in tokens:
+			if t == '' or t in self.index:
+				out.append(t)
+			else:
+				out.extend(f"<{c}>" for c in t)
+				out.append('')
+
+		return out
+
+	def expand_unknowns(self, line):
+		return ' '.join(self.expand_unknown_tokens(line.split(' ')))
 
 
 	def english_to_ids(self, line):
+		return list(self.pretokenized_english_to_ids(pretokenize_english(line)))
+
+	def _pretokenized_english_to_ids(self, line):
+		# Wrapped in an LRU cache per instance as self.pretokenized_english_to_ids
 		# TODO: Make greedy w.r.t. tokens with spaces in them
-		line = pretokenize_english(line)
-		line = self.expand_unknowns(line)
-		line = self.string_to_ids(line)
-		return line
+		tokens = self.expand_unknown_tokens(line.split(' '))
+		return tuple(self.lookup(i) for i in tokens)
 
 	def ids_to_english(self, line):
 		line = self.ids_to_string(line)
@@ -164,7 +244,9 @@ class Vocab(object):
 		if isinstance(v, np.int64):
 			s = self.inverse_lookup(v)
 		elif isinstance(v, np.ndarray):
-			if v.dtype == np.int64:
+			if v.dtype == np.int64 and v.ndim > 1 and not output_as_array:
+				s = self.ids_to_strings(v)
+			elif v.dtype == np.int64:
 				s = self.ids_to_string(v, output_as_array)
 			elif v.dtype == object:
 				s = bytes_to_string(v)
@@ -177,6 +259,13 @@ class Vocab(object):
 
 
 
+	def fingerprint(self):
+		"""Short hash of the vocab table and tokenizer version, to tell whether data 
+		was built with this vocab"""
+		table = [f"tokenizer {TOKENIZER_VERSION}"] + list(self.table)
+		return hashlib.sha1('\n'.join(table).encode("utf-8")).hexdigest()[:16]
+
+
 	def save(self, args):
 		with tf.gfile.GFile(args["vocab_path"], 'w') as out_file:
 			for i in self.table:
@@ -207,18 +296,25 @@ class Vocab(object):
 
 
 
+	@staticmethod
+	def count_tokens(hits:Counter, tokens:List[str]):
+		for token in tokens:
+			if token not in ["", " ", "\n"]:
+				hits[token] += 1
+
+
 	@classmethod
 	def build(cls, args, gqa_to_tokens):
 		hits = Counter()
 
-		def add(tokens:List[str]):
-			for token in tokens:
-				if token not in ["", " ", "\n"]:
-					hits[token] += 1
-
 		for i in tqdm(read_gqa(args), total=args["limit"]):
-			add(gqa_to_tokens(i))
+			cls.count_tokens(hits, gqa_to_tokens(i))
+
+		return cls.from_counts(args, hits)
+
 
+	@classmethod
+	def from_counts(cls, args, hits:Counter):
 		tokens = list()
 		tokens.extend(SPECIAL_TOKENS)
 
@@ -235,8 +331,3 @@ class Vocab(object):
 		v.save(args)
 
 		return v
-
-
-
-
-	
\ No newline at end of file
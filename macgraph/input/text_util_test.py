@@ -0,0 +1,86 @@
+import unittest
+import unittest.mock
+
+import numpy as np
+
+from .text_util import *
+
+class TestVocab(unittest.TestCase):
+
+    def setUp(self):
+        self.vocab = Vocab(SPECIAL_TOKENS + ["what", "music", "plays", "at", "?", "Pop"])
+
+    def test_lookup(self):
+        for idx, token in enumerate(self.vocab.table):
+            self.assertEqual(self.vocab.lookup(token), idx)
+
+        self.assertEqual(self.vocab.lookup("jazz"), UNK_ID)
+        self.assertIn("music", self.vocab)
+        self.assertNotIn("jazz", self.vocab)
+
+    def test_lines_to_ids(self):
+        lines = [["what", "music"], [], ["plays", "at", "jazz", "?"]]
+        ids, lengths = self.vocab.lines_to_ids(lines)
+
+        np.testing.assert_array_equal(lengths, [2, 0, 4])
+        np.testing.assert_array_equal(ids, [
+            [self.vocab.lookup(i) for i in ["what", "music"]] + [EOS_ID, EOS_ID],
+            [EOS_ID] * 4,
+            [self.vocab.lookup(i) for i in ["plays", "at"]] + [UNK_ID, self.vocab.lookup("?")],
+        ])
+
+    def test_ids_to_strings(self):
+        ids = np.array([
+            [self.vocab.lookup("Pop"), 1000],
+            [self.vocab.lookup("what"), self.vocab.lookup("music")],
+        ])
+
+        self.assertEqual(self.vocab.ids_to_strings(ids), ["Pop " + UNK, "what music"])
+        self.assertEqual(self.vocab.ids_to_string(ids[1]), "what music")
+        self.assertEqual(self.vocab.ids_to_string(ids[0], True), ["Pop", UNK])
+
+    def test_pretokenize_english(self):
+        self.assertEqual(
+            pretokenize_english("What music plays at 3?\n "),
+            f"What {SPACE} music {SPACE} plays {SPACE} at {SPACE} 3 ?")
+
+    def test_tokenize_batch(self):
+        questions = ["What music plays at 3?", "What music?"]
+        ids, lengths = self.vocab.tokenize_batch(questions)
+
+        np.testing.assert_array_equal(lengths, [len(self.vocab.english_to_ids(i)) for i in questions])
+
+        for row, length, question in zip(ids, lengths, questions):
+            np.testing.assert_array_equal(row[:length], self.vocab.english_to_ids(question))
+            np.testing.assert_array_equal(row[length:], EOS_ID)
+
+    def test_expand_unknowns(self):
+        # Unknown words are spelt out, followed by an empty token
+        self.assertEqual(
+            self.vocab.expand_unknown_tokens(["what", "xy", "music"]),
+            ["what", "<x>", "<y>", "", "music"])
+
+    def test_unknown_substring_of_known_token(self):
+        # Only whole unknown tokens are spelt out. The old line.replace also spelt 
+        # out "Pop" inside "Popular", leaving the known token broken up
+        vocab = Vocab(SPECIAL_TOKENS + ["Popular", "music"])
+
+        self.assertEqual(
+            vocab.expand_unknown_tokens(["Pop", "Popular", "music"]),
+            ["<P>", "<o>", "<p>", "", "Popular", "music"])
+
+        ids = vocab.english_to_ids("Pop Popular music")
+        self.assertEqual(ids[-3:], [vocab.lookup(i) for i in ["Popular", SPACE, "music"]])
+
+    def test_fingerprint_tokenizer_version(self):
+        # Records tokenized differently must not count as built with this vocab
+        fingerprint = self.vocab.fingerprint()
+
+        with unittest.mock.patch(f"{Vocab.__module__}.TOKENIZER_VERSION", TOKENIZER_VERSION + 1):
+            self.assertNotEqual(self.vocab.fingerprint(), fingerprint)
+
+        self.assertEqual(self.vocab.fingerprint(), fingerprint)
+
+
+if __name__ == '__main__':
+    unittest.main()
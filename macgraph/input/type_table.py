@@ -0,0 +1,67 @@
+
+import tensorflow as tf
+import hashlib
+
+# The type_id of records whose type isn't in the table
+UNKNOWN_TYPE_ID = -1
+
+class UnknownTypeError(Exception):
+	"""A question type missing from the saved table. Not a ValueError, so a build
+	stops on it rather than skipping the doc."""
+	pass
+
+class TypeTable(object):
+	"""Dense integer ids for question type strings, saved one per line (the
+	line number is the id). Built alongside the vocab."""
+
+	def __init__(self, types=[]):
+		self.types = list(types)
+		self.index = {t: i for i, t in enumerate(self.types)}
+
+	def __len__(self):
+		return len(self.types)
+
+	def lookup(self, type_string):
+		return self.index.get(type_string, UNKNOWN_TYPE_ID)
+
+	def strict_lookup(self, type_string):
+		if type_string not in self.index:
+			raise UnknownTypeError(f"Question type {type_string} isn't in the type table, rebuild without --skip-vocab to add it")
+		return self.index[type_string]
+
+	def inverse_lookup(self, type_id):
+		if 0 <= type_id < len(self.types):
+			return self.types[type_id]
+		return ""
+
+	def matching(self, prefix):
+		"""Ids of the types starting with prefix"""
+		return [i for i, t in enumerate(self.types) if prefix is None or t.startswith(prefix)]
+
+	def fingerprint(self):
+		"""Short hash of the table, to tell whether records' type ids came from it"""
+		return hashlib.sha1('\n'.join(self.types).encode("utf-8")).hexdigest()[:16]
+
+	@classmethod
+	def from_types(cls, types):
+		"""Sorted, so the ids don't depend on the order docs are read in"""
+		return cls(sorted(set(types)))
+
+	def save(self, args):
+		with tf.gfile.GFile(args["type_ids_path"], 'w') as out_file:
+			for i in self.types:
+				out_file.write(i + "\n")
+
+	@classmethod
+	def load(cls, args):
+		with tf.gfile.GFile(args["type_ids_path"]) as file:
+			return cls(line.rstrip("\n") for line in file)
+
+	@classmethod
+	def load_if_exists(cls, args):
+		"""None for data built before type ids (e.g. the download), whose records 
+		only have the type_string"""
+		if not tf.gfile.Exists(args["type_ids_path"]):
+			return None
+		return cls.load(args)
+
@@ -0,0 +1,28 @@
+import unittest
+
+from .type_table import *
+
+class TestTypeTable(unittest.TestCase):
+
+    def test_lookup(self):
+        types = TypeTable.from_types(["StationPropertySize", "StationAdjacent", "StationPropertySize"])
+
+        self.assertEqual(types.types, ["StationAdjacent", "StationPropertySize"])
+        self.assertEqual(types.lookup("StationPropertySize"), 1)
+        self.assertEqual(types.lookup("Missing"), UNKNOWN_TYPE_ID)
+        self.assertEqual(types.inverse_lookup(0), "StationAdjacent")
+        self.assertEqual(types.inverse_lookup(UNKNOWN_TYPE_ID), "")
+
+        self.assertEqual(types.strict_lookup("StationAdjacent"), 0)
+        with self.assertRaises(UnknownTypeError):
+            types.strict_lookup("Missing")
+
+    def test_matching(self):
+        types = TypeTable(["StationAdjacent", "StationPropertySize", "StationPropertyMusic"])
+
+        self.assertEqual(types.matching("StationProperty"), [1, 2])
+        self.assertEqual(types.matching(None), [0, 1, 2])
+
+
+if __name__ == '__main__':
+    unittest.main()
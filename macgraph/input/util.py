@@ -1,10 +1,16 @@
 
+import re
 import yaml
+import json
+import os.path
+import urllib.parse
 import tensorflow as tf
-import random
 from tqdm import tqdm
 from collections import Counter
 
+from .profiler import NO_PROFILER
+from .columns import COLUMNS_EXTENSION, ColumnWriter, Columns, remove_columns, columns_size
+
 import logging
 logger = logging.getLogger(__name__)
 
@@ -19,6 +25,18 @@ def min_none(a, b):
 		return a
 	return min(a,b)
 
+def chunked(iterable, size):
+	"""Yield lists of up to size items from iterable"""
+	chunk = []
+	for i in iterable:
+		chunk.append(i)
+		if len(chunk) >= size:
+			yield chunk
+			chunk = []
+
+	if len(chunk) > 0:
+		yield chunk
+
 
 # --------------------------------------------------------------------------
 # TFRecord functions
@@ -41,17 +59,17 @@ def write_string_feature(value):
 
 # TODO: Better naming / structure
 
-def parse_feature_int_array():
-	return tf.FixedLenSequenceFeature([],tf.int64, allow_missing=True)
+def parse_feature_int_array(default_value=None):
+	return tf.FixedLenSequenceFeature([],tf.int64, allow_missing=True, default_value=default_value)
 
 def parse_feature_boolean_array():
 	return parse_feature_int_array()
 
-def parse_feature_string():
-	return tf.FixedLenSequenceFeature([],tf.string, allow_missing=True)
+def parse_feature_string(default_value=None):
+	return tf.FixedLenSequenceFeature([],tf.string, allow_missing=True, default_value=default_value)
 
-def parse_feature_int():
-	return tf.FixedLenFeature([], tf.int64)
+def parse_feature_int(default_value=None):
+	return tf.FixedLenFeature([], tf.int64, default_value=default_value)
 
 
 # --------------------------------------------------------------------------
@@ -67,46 +85,224 @@ def tf_startswith(tensor, prefix, axis=None):
 # File readers and writers
 # --------------------------------------------------------------------------
 
+# libyaml's C loader is many times faster than the pure Python one, use it if installed
+YamlLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+def is_jsonl_path(path):
+	return path.endswith(".jsonl")
+
+
+def read_gqa_docs(path):
+	"""Stream every doc from a GQA file, either YAML or JSON-lines (one doc per line)"""
+	with tf.gfile.GFile(path, 'r') as in_file:
+		if is_jsonl_path(path):
+			for line in in_file:
+				if line.strip() != "":
+					yield json.loads(line)
+		else:
+			yield from yaml.load_all(in_file, Loader=YamlLoader)
+
+
 def read_gqa(args):
-	with tf.gfile.GFile(args["gqa_path"], 'r') as in_file:
-		d = yaml.safe_load_all(in_file)
-
-		ctr = 0
-
-		for i in d:
-			if i is not None:
-				if args["type_string_prefix"] is None or i["question"]["type_string"].startswith(args["type_string_prefix"]):
-					yield i
-					ctr += 1
-					if args["limit"] is not None and ctr >= args["limit"]:
-						logger.debug("Hit limit, stop")
-						return
-				else:
-					logger.debug(f"{i['question']['type_string']} does not match prefix {args['type_string_prefix']}")
+	ctr = 0
+
+	for i in read_gqa_docs(args["gqa_path"]):
+		if i is not None:
+			if args["type_string_prefix"] is None or i["question"]["type_string"].startswith(args["type_string_prefix"]):
+				yield i
+				ctr += 1
+				if args["limit"] is not None and ctr >= args["limit"]:
+					logger.debug("Hit limit, stop")
+					return
 			else:
-				logger.debug("Skipping None yaml doc")
+				logger.debug(f"{i['question']['type_string']} does not match prefix {args['type_string_prefix']}")
+		else:
+			logger.debug("Skipping None yaml doc")
+
+# --------------------------------------------------------------------------
+# TFRecord files
+# --------------------------------------------------------------------------
+
+COMPRESSION_EXTENSIONS = {
+	"NONE": "",
+	"GZIP": ".gz",
+	"ZLIB": ".zz",
+}
+
+RECORD_FORMATS = ["tfrecord", "columns"]
+
+# Marks the type string in the name of a file only holding that type
+TYPE_PARTITION_MARKER = ".type-"
+
+def quote_type_string(type_string):
+	"""Escape a type string for a file name, including the . and - the rest of the name uses"""
+	return urllib.parse.quote(type_string, safe="").replace(".", "%2E").replace("-", "%2D")
+
+def record_path(args, mode, shard=0, num_shards=1, compression="NONE", generation=0, record_format="tfrecord", type_string=None):
+	"""Path of one shard of a mode's TFRecords. An unsharded, uncompressed, first 
+	generation mode is the plain {mode}_input_path. 
+
+	Incremental builds add later generations of files alongside the earlier ones.
+	In the columns format each of these is a directory instead. Builds 
+	partitioned by type have a set of files for each type string."""
+	if record_format == "columns":
+		ext = COLUMNS_EXTENSION
+	else:
+		ext = ".tfrecords" + COMPRESSION_EXTENSIONS[compression]
+
+	name = f"{mode}_input"
+
+	if type_string is not None:
+		name += TYPE_PARTITION_MARKER + quote_type_string(type_string)
+
+	if generation > 0:
+		name += f".g{generation:04d}"
+
+	if num_shards > 1:
+		name += f"-{shard:05d}-of-{num_shards:05d}"
+
+	return os.path.join(args["input_dir"], f"{name}{ext}")
+
+def record_compression(path):
+	for k, v in COMPRESSION_EXTENSIONS.items():
+		if v != "" and path.endswith(v):
+			return k
+	return "NONE"
+
+def record_options(compression):
+	return tf.python_io.TFRecordOptions(getattr(tf.python_io.TFRecordCompressionType, compression))
+
+def dataset_compression_type(compression):
+	"""The compression_type string TFRecordDataset expects"""
+	return "" if compression == "NONE" else compression
+
+
+def input_files(args, mode, record_format=None):
+	"""All the shards for mode, in args' record format unless given one"""
+	record_format = record_format or args["record_format"]
+
+	if record_format == "columns":
+		return sorted(tf.gfile.Glob(args[f"{mode}_columns_pattern"]))
+
+	return sorted(tf.gfile.Glob(args[f"{mode}_input_pattern"]))
+
+def file_type_string(path):
+	"""The type string of every record in a type partitioned file, otherwise None"""
+	name = os.path.basename(path)
+
+	if TYPE_PARTITION_MARKER not in name:
+		return None
+
+	quoted = name.split(TYPE_PARTITION_MARKER, 1)[1]
+	quoted = re.split(r"[.-]", quoted, 1)[0]
+	return urllib.parse.unquote(quoted)
+
+def prefix_input_files(args, mode):
+	"""The shards of mode that can hold records with args' type string prefix, 
+	and whether their records still need filtering by it"""
+	files = input_files(args, mode)
+	prefix = args["type_string_prefix"]
+
+	if prefix is None:
+		return files, False
+
+	types = [file_type_string(i) for i in files]
+	matching = [f for f, t in zip(files, types) if t is None or t.startswith(prefix)]
+
+	return matching, any(t is None for t in types)
+
+def remove_input_file(path):
+	if path.endswith(COLUMNS_EXTENSION):
+		remove_columns(path)
+	else:
+		tf.gfile.Remove(path)
+
+def input_file_size(path):
+	if path.endswith(COLUMNS_EXTENSION):
+		return columns_size(path)
+	return tf.gfile.Stat(path).length
+
+def read_records(args, mode):
+	"""Iterate over the serialized records of every TFRecord shard of mode"""
+	if args["record_format"] != "tfrecord":
+		raise ValueError(f"Can only read serialized records from TFRecords, not {args['record_format']}")
+
+	for path in input_files(args, mode):
+		yield from tf.python_io.tf_record_iterator(path, options=record_options(record_compression(path)))
+
+def count_records(args, mode):
+	if args["record_format"] == "columns":
+		return sum(len(Columns(i)) for i in input_files(args, mode))
+
+	return sum(1 for _ in read_records(args, mode))
+
 
 class Partitioner(object):
 
-	def __init__(self, args):
+	def __init__(self, args, generation=0, profiler=NO_PROFILER):
 		self.args = args
+		self.generation = generation
+		self.profiler = profiler
+		self.num_shards = args["shards"]
+		self.compression = args["compression"]
+		self.record_format = args["record_format"]
+		self.partition_by_type = args["partition_by_type"]
 		self.written = 0
 		self.answer_classes = Counter()
 		self.answer_classes_types = Counter()
 
+		# Filled in on exit, a description of each file written for the manifest
+		self.shards_written = []
+
+
+	def open(self, path):
+		if self.record_format == "columns":
+			return ColumnWriter(path, self.args["kb_node_width"])
+
+		return tf.python_io.TFRecordWriter(path, options=record_options(self.compression))
+
+
+	def file(self, mode, type_string, shard):
+		"""The writer for a (mode, type_string, shard), type_string is None
+		unless partitioning by type. Type partitions are opened on first use."""
+		key = (mode, type_string, shard)
+
+		if key not in self.files:
+			self.paths[key] = record_path(self.args, mode, shard, self.num_shards, 
+				self.compression, self.generation, self.record_format, type_string)
+			self.files[key] = self.open(self.paths[key])
+			self.shard_counts[key] = Counter()
+
+		return self.files[key]
 
 
 	def __enter__(self, *vargs):
-		self.files = {
-			i: tf.python_io.TFRecordWriter(self.args[f"{i}_input_path"]) 
-			for i in self.args['modes']
-		}
+		self.files = {}
+		self.paths = {}
+		self.shard_counts = {}
+
+		for mode in self.args['modes']:
+			# Don't leave shards from a previous build (in either format) lying 
+			# around for input_fn to read
+			if self.generation == 0:
+				for record_format in RECORD_FORMATS:
+					for path in input_files(self.args, mode, record_format):
+						remove_input_file(path)
+
+			if not self.partition_by_type:
+				for shard in range(self.num_shards):
+					self.file(mode, None, shard)
 
 		return self
 
 
-	def write(self, doc, record):
-		r = random.random()
+	def choose(self, h):
+		"""Pick mode and shard from the doc's hash (see manifest.doc_hash), so the same 
+		question always lands in the same place, whatever vocab or record format it's 
+		built with (and rebuilds are reproducible)"""
+		h = bytes.fromhex(h)
+		r = int.from_bytes(h[:8], "big") / 2**64
+		shard = int.from_bytes(h[8:], "big") % self.num_shards
 
 		if r < self.args["eval_holdback"]:
 			mode = "eval"
@@ -115,20 +311,52 @@ class Partitioner(object):
 		else:
 			mode = "train"
 
-		key = (str(doc["answer"]), doc["question"]["type_string"])
+		return mode, shard
+
+
+	def write(self, keys, record):
+		"""Write a record, keys is its (answer, type_string, doc_hash)"""
+		answer, type_string, h = keys
+		mode, shard = self.choose(h)
+
+		key = (str(answer), type_string)
+		file_key = (mode, type_string if self.partition_by_type else None, shard)
 
-		self.files[mode].write(record)
-		self.answer_classes[str(doc["answer"])] += 1
+		with self.profiler("write"):
+			self.file(*file_key).write(record)
+		self.answer_classes[str(answer)] += 1
 		self.answer_classes_types[key] += 1
+		self.shard_counts[file_key][key] += 1
 		self.written += 1
 
 
-	def __exit__(self, *vargs):
+	def __exit__(self, exc_type, *vargs):
 		for i in self.files.values():
 			i.close()
 
 		self.files = None
 
+		# Don't leave a partial build for input_fn to read
+		if exc_type is not None:
+			for path in self.paths.values():
+				if tf.gfile.Exists(path):
+					remove_input_file(path)
+			return
+
+		for (mode, type_string, shard), counts in sorted(self.shard_counts.items(), key=lambda i: self.paths[i[0]]):
+			path = self.paths[(mode, type_string, shard)]
+			self.shards_written.append({
+				"path": os.path.basename(path),
+				"mode": mode,
+				"type_string": type_string,
+				"shard": shard,
+				"generation": self.generation,
+				"format": self.record_format,
+				"compression": self.compression,
+				"records": sum(counts.values()),
+				"bytes": input_file_size(path),
+				"answer_classes_types": counts,
+			})
 
 
 # --------------------------------------------------------------------------
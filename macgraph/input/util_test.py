@@ -0,0 +1,46 @@
+import unittest
+import tempfile
+
+from .util import *
+from .args import get_args
+
+class TestTypePartitions(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.args = get_args(argv=["--input-dir", self.dir.name])
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_type_string_round_trip(self):
+        for type_string in ["StationPropertyMusic", "a.b-c d/%"]:
+            path = record_path(self.args, "train", 1, 4, "GZIP", 2, type_string=type_string)
+            self.assertEqual(file_type_string(path), type_string)
+
+        self.assertIsNone(file_type_string(record_path(self.args, "train", 1, 4)))
+
+    def test_prefix_input_files(self):
+        for type_string in ["StationPropertyMusic", "StationAdjacent"]:
+            open(record_path(self.args, "train", type_string=type_string), "w").close()
+
+        self.args["type_string_prefix"] = "StationProperty"
+        files, needs_filter = prefix_input_files(self.args, "train")
+        self.assertEqual([file_type_string(i) for i in files], ["StationPropertyMusic"])
+        self.assertFalse(needs_filter)
+
+        # Files that aren't partitioned could hold any type
+        open(record_path(self.args, "train"), "w").close()
+        files, needs_filter = prefix_input_files(self.args, "train")
+        self.assertEqual(len(files), 2)
+        self.assertTrue(needs_filter)
+
+    def test_choose_by_doc_hash(self):
+        partitioner = Partitioner({**self.args, "shards": 4})
+
+        self.assertEqual(partitioner.choose("00" * 16), ("eval", 0))
+        self.assertEqual(partitioner.choose("ff" * 16), ("train", 3))
+
+
+if __name__ == '__main__':
+    unittest.main()
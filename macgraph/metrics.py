@@ -0,0 +1,65 @@
+
+import tensorflow as tf
+
+# --------------------------------------------------------------------------
+# A streaming confusion matrix per question type.
+#
+# One metric variable and one update op count (type, actual, predicted)
+# over the eval, and every per-type and per-class accuracy is read off it,
+# so adding question types or answer classes doesn't add update ops.
+#
+# Like tf.metrics, the update op evaluates to the counts after the batch
+# is added, so an accuracy read off it is that metric's own update op.
+# --------------------------------------------------------------------------
+
+def type_confusion_matrix(type_ids, labels, predictions, num_types, num_classes, name="type_confusion_matrix"):
+	"""Returns the counts, shape [num_types+1, num_classes, num_classes] indexed
+	by [type, actual, predicted] (the last type counts unknown type ids), and
+	the op that adds a batch to them, which evaluates to the updated counts"""
+
+	with tf.variable_scope(name):
+		size = (num_types + 1) * num_classes * num_classes
+
+		counts = tf.get_variable("counts", 
+			shape=[size], 
+			dtype=tf.int64,
+			initializer=tf.zeros_initializer(),
+			trainable=False,
+			collections=[tf.GraphKeys.LOCAL_VARIABLES, tf.GraphKeys.METRIC_VARIABLES],
+			use_resource=True)
+
+		type_ids = tf.to_int64(type_ids)
+		type_ids = tf.where(
+			tf.logical_and(type_ids >= 0, type_ids < num_types),
+			type_ids,
+			tf.fill(tf.shape(type_ids), tf.cast(num_types, tf.int64)))
+
+		index = (type_ids * num_classes + tf.to_int64(labels)) * num_classes + tf.to_int64(predictions)
+		scatter = tf.scatter_add(counts, index, tf.ones_like(index))
+
+		shape = [num_types + 1, num_classes, num_classes]
+
+		# Read after the scatter, not alongside it
+		with tf.control_dependencies([scatter]):
+			update_op = tf.reshape(counts.read_value(), shape)
+
+		return tf.reshape(counts, shape), update_op
+
+
+def accuracy(correct, total):
+	"""0 where there's nothing to count, like tf.metrics.accuracy"""
+	correct = tf.to_double(correct)
+	total = tf.to_double(total)
+	return tf.where(total > 0, correct / tf.maximum(total, 1.0), tf.zeros_like(total))
+
+def type_accuracies(counts):
+	"""Accuracy for each type, shape [num_types+1]"""
+	correct = tf.reduce_sum(tf.matrix_diag_part(counts), -1)
+	total = tf.reduce_sum(counts, [1, 2])
+	return accuracy(correct, total)
+
+def class_accuracies(counts):
+	"""Accuracy for each actual class, over all types, shape [num_classes]"""
+	all_types = tf.reduce_sum(counts, 0)
+	return accuracy(tf.matrix_diag_part(all_types), tf.reduce_sum(all_types, 1))
+
@@ -0,0 +1,70 @@
+import unittest
+
+import tensorflow as tf
+
+import numpy as np
+
+from .metrics import *
+
+class TestMetrics(unittest.TestCase):
+
+    def test_type_confusion_matrix(self):
+
+        # Run like an eval: local variables initialized, then an update per batch
+        with tf.Graph().as_default():
+            type_ids = tf.placeholder(tf.int64, [None])
+            labels = tf.placeholder(tf.int64, [None])
+            predictions = tf.placeholder(tf.int64, [None])
+
+            counts, update_op = type_confusion_matrix(type_ids, labels, predictions, 2, 3)
+            type_accuracy = type_accuracies(counts)
+            class_accuracy = class_accuracies(counts)
+
+            with tf.Session() as session:
+                session.run(tf.local_variables_initializer())
+
+                session.run(update_op, {type_ids: [0, 0, 1], labels: [0, 1, 1], predictions: [0, 0, 1]})
+                updated = session.run(update_op, {type_ids: [1, -1], labels: [2, 2], predictions: [1, 2]})
+
+                counts, type_accuracy, class_accuracy = session.run([counts, type_accuracy, class_accuracy])
+
+        np.testing.assert_array_equal(updated, counts)
+
+        self.assertEqual(counts.shape, (3, 3, 3))
+        self.assertEqual(counts.sum(), 5)
+        self.assertEqual(counts[2, 2, 2], 1)
+
+        np.testing.assert_almost_equal(type_accuracy, [0.5, 0.5, 1.0])
+        np.testing.assert_almost_equal(class_accuracy, [1.0, 0.5, 0.5])
+
+    def test_update_op_value(self):
+
+        # The hook reads each metric's update op, which must be that metric's 
+        # accuracy after the batch, not the counts
+        with tf.Graph().as_default():
+            type_ids = tf.placeholder(tf.int64, [None])
+            labels = tf.placeholder(tf.int64, [None])
+            predictions = tf.placeholder(tf.int64, [None])
+
+            counts, update_op = type_confusion_matrix(type_ids, labels, predictions, 2, 3)
+            type_accuracy_update = type_accuracies(update_op)
+            class_accuracy_update = class_accuracies(update_op)
+
+            with tf.Session() as session:
+                session.run(tf.local_variables_initializer())
+
+                first = session.run([type_accuracy_update[0], class_accuracy_update[1]], 
+                    {type_ids: [0, 0, 1], labels: [0, 1, 1], predictions: [0, 0, 1]})
+                second = session.run([type_accuracy_update[0], class_accuracy_update[1]], 
+                    {type_ids: [0, 1], labels: [1, 1], predictions: [1, 0]})
+
+        np.testing.assert_almost_equal(first, [0.5, 0.5])
+        np.testing.assert_almost_equal(second, [2/3, 0.5])
+
+    def test_accuracy_empty(self):
+        with tf.Graph().as_default(), tf.Session() as session:
+            np.testing.assert_almost_equal(session.run(accuracy([0, 1], [0, 2])), [0.0, 0.5])
+
+
+if __name__ == '__main__':
+    unittest.main()
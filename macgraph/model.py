@@ -7,6 +7,7 @@ from .cell import *
 from .util import *
 from .hooks import *
 from .input import *
+from .metrics import *
 
 def model_fn(features, labels, mode, params):
 
@@ -16,6 +17,9 @@ def model_fn(features, labels, mode, params):
 
 	args = params
 
+	# Runtime checks are only sampled when training (see util.runtime_check)
+	set_graph_mode(mode)
+
 	# EstimatorSpec slots
 	loss = None
 	train_op = None
@@ -25,6 +29,11 @@ def model_fn(features, labels, mode, params):
 
 	vocab = Vocab.load(args)
 
+	# How much of each batch is padding (see --bucket-by-length)
+	padding = padding_efficiency(features)
+	for k, (efficiency, size) in padding.items():
+		tf.summary.scalar("padding_efficiency/"+k, efficiency, family="input")
+
 	# --------------------------------------------------------------------------
 	# Shared variables
 	# --------------------------------------------------------------------------
@@ -44,14 +53,15 @@ def model_fn(features, labels, mode, params):
 
 	question_tokens_emb = tf.nn.embedding_lookup(vocab_embedding, features["src"])
 
-	# The control state is focusing on one of the input tokens
-	out_control_state, tap_question_attn = control_cell(args, features, question_tokens_emb)
+	with jit_scope(args):
+		# The control state is focusing on one of the input tokens
+		out_control_state, tap_question_attn = control_cell(args, features, question_tokens_emb)
 
-	# The read cell pulls out the relevant node property from the graph
-	read, read_taps = read_cell(args, features, vocab_embedding, out_control_state, question_tokens_emb)
-	
-	# The output cell transforms that property for output
-	logits = output_cell(args, features, read, out_control_state)	
+		# The read cell pulls out the relevant node property from the graph
+		read, read_taps = read_cell(args, features, vocab_embedding, out_control_state, question_tokens_emb)
+		
+		# The output cell transforms that property for output
+		logits = output_cell(args, features, read, out_control_state)	
 
 	# For visualisation of what attention is doing (try running predict.py)
 	taps = {
@@ -91,20 +101,27 @@ def model_fn(features, labels, mode, params):
 
 	if mode in [tf.estimator.ModeKeys.PREDICT, tf.estimator.ModeKeys.EVAL]:
 
-		predicted_labels = tf.argmax(tf.nn.softmax(logits), axis=-1)
+		probabilities = tf.nn.softmax(logits)
+		predicted_labels = tf.argmax(probabilities, axis=-1)
 
 		predictions = {
 			"predicted_label": predicted_labels,
 			"actual_label": features["label"],
 		}
 
-		# For diagnostic visualisation
-		predictions.update(features)
-		predictions.update(taps)
+		# Everything in here is copied out of the session for every example,
+		# so bulk prediction only asks for the labels
+		if args["predict_output"] in ["scores", "full"]:
+			predictions["score"] = tf.reduce_max(probabilities, axis=-1)
 
-		# Fake features do not have batch, must be removed
-		del predictions["d_batch_size"]
-		del predictions["d_src_len"]
+		if args["predict_output"] == "full":
+			# For diagnostic visualisation
+			predictions.update(features)
+			predictions.update(taps)
+
+			# Fake features do not have batch, must be removed
+			del predictions["d_batch_size"]
+			del predictions["d_src_len"]
 
 	# --------------------------------------------------------------------------
 	# Eval metrics
@@ -116,28 +133,38 @@ def model_fn(features, labels, mode, params):
 			"accuracy": tf.metrics.accuracy(labels=labels, predictions=predicted_labels),
 		}
 
-		# Add per class and per question type accuracy metrics
+		# Weighted by batch size, these are the overall fraction of real data
+		for k, (efficiency, size) in padding.items():
+			eval_metric_ops["padding_efficiency_"+k] = tf.metrics.mean(efficiency, weights=size)
 
-		try:
-			with tf.gfile.GFile(args["question_types_path"]) as file:
-				doc = yaml.load(file)
-				for type_string in doc.keys():
-					if args["type_string_prefix"] is None or type_string.startswith(args["type_string_prefix"]):
-						eval_metric_ops["type_accuracy_"+type_string] = tf.metrics.accuracy(
-							labels=labels, 
-							predictions=predicted_labels, 
-							weights=tf.equal(features["type_string"], type_string))
+		# Per class and per question type accuracy metrics, all read off one confusion 
+		# matrix so there's a single scatter however many there are. Each metric's 
+		# update op is its own accuracy read off the updated matrix
 
+		# Without a type table (data built before type ids) every record counts 
+		# as the unknown type, which the class accuracies still sum over
+		types = TypeTable.load_if_exists(args) or TypeTable()
 
+		confusion, confusion_update = type_confusion_matrix(
+			features["type_id"], labels, predicted_labels, 
+			len(types), args["output_classes"])
+
+		type_accuracy = type_accuracies(confusion)
+		type_accuracy_update = type_accuracies(confusion_update)
+		for type_id in types.matching(args["type_string_prefix"]):
+			eval_metric_ops["type_accuracy_"+types.inverse_lookup(type_id)] = (
+				type_accuracy[type_id], type_accuracy_update[type_id])
+
+		try:
 			with tf.gfile.GFile(args["answer_classes_path"]) as file:
-				doc = yaml.load(file)
-				for answer_class in doc.keys():
-					e = vocab.lookup(pretokenize_json(answer_class))
-					weights = tf.equal(labels, tf.cast(e, tf.int64))
-					eval_metric_ops["class_accuracy_"+str(answer_class)] = tf.metrics.accuracy(
-						labels=labels, 
-						predictions=predicted_labels, 
-						weights=weights)
+				answer_classes = yaml.load(file)
+
+			class_accuracy = class_accuracies(confusion)
+			class_accuracy_update = class_accuracies(confusion_update)
+			for answer_class in answer_classes.keys():
+				e = vocab.lookup(pretokenize_json(answer_class))
+				eval_metric_ops["class_accuracy_"+str(answer_class)] = (
+					class_accuracy[e], class_accuracy_update[e])
 
 		except tf.errors.NotFoundError as err:
 			print(err)
@@ -11,7 +11,9 @@ import os.path
 from .input.text_util import UNK_ID
 from .estimator import get_estimator
 from .input import *
+from .input.manifest import record_count
 from .util import *
+from .args import get_args, generate_args_derivatives, global_args
 
 import logging
 logger = logging.getLogger(__name__)
@@ -39,6 +41,9 @@ def color_text(text_array, levels, color_fg=True):
 
 
 def predict(args, cmd_args):
+	# print_row shows the question and the attention over it
+	args = {**args, "predict_output": "full"}
+
 	estimator = get_estimator(args)
 
 	# Logging setup
@@ -48,12 +53,13 @@ def predict(args, cmd_args):
 	logging.getLogger("mac-graph").setLevel(args["log_level"])
 
 	# Info about the experiment, for the record
-	tfr_size = sum(1 for _ in tf.python_io.tf_record_iterator(args["predict_input_path"]))
+	tfr_size = record_count(args, "predict")
 	logger.info(f"Predicting on {tfr_size} input records")
 
 	# Actually do some work
 	predictions = estimator.predict(input_fn=gen_input_fn(args, "predict"))
 	vocab = Vocab.load(args)
+	types = TypeTable.load_if_exists(args)
 
 	def print_row(row):
 		if p["actual_label"] == p["predicted_label"]:
@@ -70,7 +76,7 @@ def predict(args, cmd_args):
 			print("Question: ", ' '.join(color_text(row["src"], control_head)))
 
 		noun = "kb_node"
-		db = [vocab.prediction_value_to_string(kb_row) for kb_row in row[f"{noun}s"]]
+		db = vocab.prediction_value_to_string(row[f"{noun}s"])
 		print("node extract: ",', '.join(color_text(db, row[f"{noun}_attn"])))
 
 		for idx, attn in enumerate(row[f"{noun}_attn"]):
@@ -84,9 +90,15 @@ def predict(args, cmd_args):
 		hr()
 
 	def decode_row(row):
-		for i in ["type_string", "actual_label", "predicted_label", "src"]:
+		for i in ["actual_label", "predicted_label", "src"]:
 			row[i] = vocab.prediction_value_to_string(row[i], True)
 
+		# Data without type ids has the type string itself
+		if types is None:
+			row["type_string"] = row["type_string"].decode("utf-8")
+		else:
+			row["type_string"] = types.inverse_lookup(int(row["type_id"]))
+
 	stats = Counter()
 	output_classes = Counter()
 	predicted_classes = Counter()
@@ -97,25 +109,23 @@ def predict(args, cmd_args):
 			break
 
 		decode_row(p)
-		if cmd_args["type_string_prefix"] is None or p["type_string"].startswith(cmd_args["type_string_prefix"]):
 
-			output_classes[p["actual_label"]] += 1
-			predicted_classes[p["predicted_label"]] += 1
+		output_classes[p["actual_label"]] += 1
+		predicted_classes[p["predicted_label"]] += 1
 
-			correct = p["actual_label"] == p["predicted_label"]
+		correct = p["actual_label"] == p["predicted_label"]
 
-			if correct:
-				emoji = "✅"
-			else:
-				emoji = "❌"
+		if correct:
+			emoji = "✅"
+		else:
+			emoji = "❌"
 
-			confusion[emoji + " \texp:" + p["actual_label"] +" \tact:" + p["predicted_label"] + " \t" + p["type_string"]] += 1
+		confusion[emoji + " \texp:" + p["actual_label"] +" \tact:" + p["predicted_label"] + " \t" + p["type_string"]] += 1
 
-			should_print = (cmd_args["correct_only"] and correct) or (cmd_args["wrong_only"] and not correct) or (not cmd_args["correct_only"] and not cmd_args["wrong_only"])
+		should_print = (cmd_args["correct_only"] and correct) or (cmd_args["wrong_only"] and not correct) or (not cmd_args["correct_only"] and not cmd_args["wrong_only"])
 
-			if should_print:
-				print_row(p)
-			
+		if should_print:
+			print_row(p)
 
 
 if __name__ == "__main__":
@@ -133,6 +143,18 @@ if __name__ == "__main__":
 	with tf.gfile.GFile(os.path.join(cmd_args["model_dir"], "config.yaml"), "r") as file:
 		frozen_args = yaml.load(file)
 
+	# Configs saved by older versions may be missing newer args and derived paths
+	frozen_args = {**get_args(argv=[]), **frozen_args}
+	frozen_args.update(generate_args_derivatives(frozen_args))
+
+	# Filter in the input pipeline, so skipped rows aren't read or run through the model
+	if cmd_args["type_string_prefix"] is not None:
+		frozen_args["type_string_prefix"] = cmd_args["type_string_prefix"]
+
+	# get_args filled this in with the defaults
+	global_args.clear()
+	global_args.update(frozen_args)
+
 	hr()
 
 	predict(frozen_args, cmd_args)
@@ -5,7 +5,8 @@ import tensorflow as tf
 from tensorflow.python import debug as tf_debug
 
 from .estimator import get_estimator
-from .input import gen_input_fn
+from .input import gen_input_fn, EVAL_STEPS
+from .input.manifest import record_count
 from .args import *
 from .predict import predict
 from .util import download_data
@@ -38,6 +39,7 @@ def train(args):
 	
 	eval_spec  = tf.estimator.EvalSpec(
 		input_fn=gen_input_fn(args, "eval"),
+		steps=EVAL_STEPS,
 		throttle_secs=args["eval_every"])
 
 	tf.estimator.train_and_evaluate(estimator, train_spec, eval_spec)
@@ -57,7 +59,7 @@ if __name__ == "__main__":
 	download_data(args)
 
 	# Info about the experiment, for the record
-	train_size = sum(1 for _ in tf.python_io.tf_record_iterator(args["train_input_path"]))
+	train_size = record_count(args, "train")
 	logger.info(f"Training on {train_size} records")
 
 	hr()
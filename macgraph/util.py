@@ -4,8 +4,11 @@ import math
 import urllib.request
 import pathlib
 import zipfile
+from contextlib import contextmanager
 from colored import fg, bg, stylize
 
+from .args import global_args
+
 # Block annoying warnings
 def hr():
 	print(stylize("---------------", fg("blue")))
@@ -25,6 +28,67 @@ def assert_rank(tensor, rank):
 	assert len(tensor.shape) == rank, f"{tensor.name} is wrong rank, expected {rank} got {len(tensor.shape)}"
 
 
+# --------------------------------------------------------------------------
+# Runtime checks, built into the graph according to --assertions:
+#  - debug: on every step
+#  - sampled: every --assertion-every training steps, every step of eval and predict
+#  - off: not built at all
+# --------------------------------------------------------------------------
+
+# Holds the Estimator mode a graph is built for, see set_graph_mode
+MODE_COLLECTION = "macgraph_mode"
+
+def set_graph_mode(mode):
+	"""Record the tf.estimator.ModeKeys the default graph is being built for"""
+	tf.add_to_collection(MODE_COLLECTION, mode)
+
+def graph_mode():
+	"""The mode set_graph_mode recorded for the default graph, or None"""
+	modes = tf.get_collection(MODE_COLLECTION)
+	return modes[-1] if len(modes) > 0 else None
+
+
+def runtime_check(make_check):
+	"""Build the check op that make_check returns, per the assertion policy. 
+
+	Returns something to take a control dependency on, or None if there's no check."""
+
+	level = global_args.get("assertions", "debug")
+
+	if level == "off":
+		return None
+
+	global_step = tf.train.get_global_step()
+	mode = graph_mode()
+
+	# Eval and predict graphs have a global step too, but it's the checkpoint's 
+	# and doesn't change during a round, so sampling by it would check all of 
+	# the round or none of it. Without a step (e.g. in tests) there's nothing 
+	# to sample by either.
+	if level == "debug" or global_step is None or (mode is not None and mode != tf.estimator.ModeKeys.TRAIN):
+		return make_check()
+
+	def check():
+		with tf.control_dependencies([make_check()]):
+			return tf.constant(True)
+
+	return tf.cond(
+		tf.equal(global_step % global_args.get("assertion_every", 100), 0), 
+		check, 
+		lambda: tf.constant(False))
+
+
+def check_numerics(tensor, message):
+	"""tf.check_numerics, per the assertion policy. Returns tensor."""
+	check = runtime_check(lambda: tf.check_numerics(tensor, message))
+
+	if check is None:
+		return tensor
+
+	with tf.control_dependencies([check]):
+		return tf.identity(tensor)
+
+
 def dynamic_assert_shape(tensor, shape, name=None):
 	"""
 	Check that a tensor has a shape given by a list of constants and tensor values.
@@ -42,24 +106,47 @@ def dynamic_assert_shape(tensor, shape, name=None):
 	You should use this as an inline identity function so that the operation it generates
 	gets added and executed in the graph
 
+	Whether the check is built at all follows --assertions. With --static-shapes 
+	every shape is already known, and the assert ops would only get in the way 
+	of XLA, so this does nothing.
+
 	Returns: the argument `tensor` unchanged
 	"""
 
-	tensor_shape = tf.shape(tensor)
-	tensor_shape = tf.cast(tensor_shape, tf.int64)
-	
-	expected_shape = tf.convert_to_tensor(shape)
-	expected_shape = tf.cast(expected_shape, tf.int64)
-	
-	t_name = "tensor" if tf.executing_eagerly() else tensor.name
+	if global_args.get("static_shapes", False):
+		return tensor
+
+	def make_check():
+		tensor_shape = tf.shape(tensor)
+		tensor_shape = tf.cast(tensor_shape, tf.int64)
+		
+		expected_shape = tf.convert_to_tensor(shape)
+		expected_shape = tf.cast(expected_shape, tf.int64)
+		
+		t_name = "tensor" if tf.executing_eagerly() else tensor.name
 
-	assert_op = tf.assert_equal(tensor_shape, expected_shape, message=f"Asserting shape of {t_name}", summarize=10, name=name)
+		return tf.assert_equal(tensor_shape, expected_shape, message=f"Asserting shape of {t_name}", summarize=10, name=name)
 
-	with tf.control_dependencies([assert_op]):
+	check = runtime_check(make_check)
+
+	if check is None:
+		return tensor
+
+	with tf.control_dependencies([check]):
 		return tf.identity(tensor, name="dynamic_assert_shape")
 
 
 
+@contextmanager
+def jit_scope(args):
+	"""Compile the ops created in this scope with XLA, if --xla-jit"""
+	if args["xla_jit"]:
+		with tf.contrib.compiler.jit.experimental_jit_scope():
+			yield
+	else:
+		yield
+
+
 def minimize_clipped(optimizer, value, max_gradient_norm, var=None):
 	global_step = tf.train.get_global_step()
 
@@ -109,7 +196,8 @@ def deeep(tensor, width, depth=2, residual_depth=3, activation=tf.nn.tanh):
 
 
 def download_data(args):
-	if not tf.gfile.Exists(args["train_input_path"]):
+	# The download is TFRecords, columns have to be built locally
+	if args["record_format"] == "tfrecord" and len(tf.gfile.Glob(args["train_input_pattern"])) == 0:
 		zip_path = "./tfrecords.zip"
 		download_url = "https://storage.googleapis.com/octavian-static/download/gqa-node-properties/tfrecords.zip"
 		print("Downloading training data (8mb)")